@@ -6,8 +6,10 @@
 # and environmental condition
 #
 #####################################################
+from __future__ import print_function
 import numpy as np
 import sys
+sys.path.append("../scripts/")
 
 
 # Store the gas properties
@@ -16,14 +18,16 @@ import sys
 
 class gas_properties:
 
-    def __init__(self):
+    # pressure may also be an array, e.g. one density ratio per run
+    # from run_pressure_ratio below; everything downstream broadcasts
+    def __init__(self, pressure=1.0, pressure_unc=0.001):
         self.name = 'P10'
         self.Emin = 48.   # units: kV/cm
         self.Emin_unc =3.
         self.dv = 23.6 /1000.# units: kV
         self.dv_unc = 5.4/1000.
-        self.pressure = 1.0 # Units = fraction of standard pressure (p/[1 bar])
-        self.pressure_unc = 0.001 # Based on monitoring over a day
+        self.pressure = pressure # Units = fraction of standard pressure (p/[1 bar])
+        self.pressure_unc = pressure_unc # Based on monitoring over a day
         self.temperature = 1.0# Units = fraction of standard temperature (T/[273.15 K])
         self.K = 4.8e4   #Units of V/cm/atm
         self.K_unc = 0.3e4   #Units of V/cm/atm
@@ -72,7 +76,6 @@ class cangeo:
         #initialize with the values in
         # theoretical_calc.py
         # this file has measurements in mm
-        sys.path.append("../scripts/")
         from theoretical_calc import cider_diameter,std_caliper
         from theoretical_calc import cider_wall,std_micrometerscrew
         from theoretical_calc import anodewire_diameter, std_micrometerscrew
@@ -86,7 +89,7 @@ class cangeo:
         self.thick_unc = std_micrometerscrew/10. #units: cm
         
         #Wire diameter      #units cm
-        self.wire = anodewire_diameter/10.  #
+        self.wire = anodewire_diameter/10000.  # listed in microns
         self.wire_unc = std_micrometerscrew/10.
 
     def __getitem__(self,key):
@@ -178,6 +181,33 @@ def lnm_beer(gas,geo,V):
     return A*B*C
 
 
+def run_pressure_ratio(runs):
+    '''
+    Time-averaged pressure (fraction of 1 bar) during each run
+
+    runs: run table as returned by mca_runs.load_runs or
+    RunCatalog.load_times, the start and real times are matched to the Helsinki pressure series
+    '''
+    from pressure import run_density_ratio
+    return run_density_ratio(runs)
+
+
+def lnm_runs(runs, geo=None, beer=False):
+    '''
+    lnm (or lnm_beer) of every run at its own voltage and gas density,
+    computed in one go for the whole run table
+    '''
+    gas = gas_properties(pressure=run_pressure_ratio(runs))
+    gas.compute_density_ratio()
+    if geo is None:
+        geo = cangeo()
+        geo.compute_useful_geo()
+    V = runs['voltage']/1000.
+    if beer:
+        return lnm_beer(gas,geo,V)
+    return lnm(gas,geo,V)
+
+
 if __name__=='__main__':
 
     import argparse
@@ -227,8 +257,8 @@ if __name__=='__main__':
 
             lnm_distributions[OV].append(lm)
 
-    print np.mean(distrib_ra),np.std(distrib_ra)
-    print np.mean(distrib_rc),np.std(distrib_rc)
+    print(np.mean(distrib_ra),np.std(distrib_ra))
+    print(np.mean(distrib_rc),np.std(distrib_rc))
 
     
     # plot everything
@@ -259,7 +289,7 @@ if __name__=='__main__':
                  ninety9,
                  median,
                  voltages],open(args.output,"wb"))
-    print "saved output to ",args.output
+    print("saved output to ",args.output)
 
     voltages = X
     plt.fill_between(voltages,one_pc,ninety9,label=r'$2\sigma$',color='m')
@@ -271,6 +271,16 @@ ln_M_am_unc = M_am_unc/M_am
 plt.errorbar(M_X_am,ln_M_am,yerr=ln_M_am_unc,fmt='sr',label=r'$Am^{241}$',color='#de2d26')
 plt.errorbar(M_X_Fe,ln_M_Fe,yerr=ln_M_Fe_unc,fmt='o',label=r'$Fe^{55}$',color='#31a354')
 
+# Prediction at the voltage and time-averaged pressure of the run behind every data point
+sys.path.append("../scripts/")
+from mca_runs import RunCatalog
+from compute_uncertainties import lnm_runs
+catalog = RunCatalog.from_directories(["../data/mca"])
+index_fe = catalog.match_index('fe',M_coarse_Fe,M_X_Fe*1000.,kind='scan')
+index_am = catalog.match_index('am',M_coarse_am,M_X_am*1000.,kind='scan')
+runs = catalog.load_times(np.concatenate([index_fe[index_fe>=0],index_am[index_am>=0]]))
+plt.plot(runs['voltage']/1000.,lnm_runs(runs),'x',color='k',label='prediction at the pressure of the run')
+
 plt.xlabel('Operating voltage (kV)',fontsize=13)
 plt.ylabel(r'$\ln(M)$',fontsize=13)
 plt.legend()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Background templates: smoothed background rates, reused by every signal run.
+
+One background run serves all signal runs of the same detector, coarse gain
+and voltage. Its template is built once: the counts divided by the time of
+the run (a rate per channel), smoothed as get_draw_spline does (or with the
+Whittaker smoother), and the error of the smoothed rate. Templates are
+stored next to the mca cache under `backgrounds/<detector>_<gain>_<voltage>`
+and rebuilt only when the background file or the settings change.
+
+A template is scaled to any time on demand, and subtracting it from a signal
+run is a single multiply-subtract, counts - time*rate, for one run or a
+whole stack. The spline smoothing factor of splrep depends on the scale of
+the contents; `smoothing` applies to the background normalised to
+`reference_time`, so with the time of the Fe run and 0.002 the template
+gives exactly the spline of fit_spectra_can.py.
+
+    templates = BackgroundTemplates(["../data/mca", "../data/mcapipe"])
+    bkg = templates.get('can', 4, 1937)
+    y, yerr = bkg.subtract(counts, meta.live_time)
+    spline_bkg = bkg.function(time_fe)             # for subtract_bkg
+
+    ./background_templates.py list
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import argparse
+import numpy as np
+
+from mca_cache import CACHE_DIR, source_stamp, load_mca
+from mca_runs import RunCatalog, parse_run_name
+from bkg_subtraction import channel_centres, with_underflow, smoothing_spline, spline_variance
+
+BACKGROUND_DIR = os.environ.get('BACKGROUND_CACHE_DIR', os.path.join(CACHE_DIR, 'backgrounds'))
+
+# bumped whenever the stored template changes
+TEMPLATE_VERSION = 1
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class BackgroundTemplate(object):
+    """
+    Background rate of one detector, gain and voltage for channels 1..n: the
+    measured rate and its variance, the smoothed rate and its variance, and
+    for method "spline" the knots, coefficients and degree of the rate spline.
+    Beyond the spline (the last channel) the smoothed rate is the measured one.
+    """
+    __slots__ = ('detector', 'gain', 'voltage', 'source', 'time', 'settings',
+                 'rate', 'variance', 'smoothed', 'smoothed_variance', 'knots', 'coefficients', 'degree')
+
+    array_fields = ('rate', 'variance', 'smoothed', 'smoothed_variance', 'knots', 'coefficients')
+
+    def __init__(self, detector, gain, voltage, source, time, settings, rate, variance, smoothed, smoothed_variance,
+                 knots=None, coefficients=None, degree=3):
+        self.detector = detector
+        self.gain = int(gain)
+        self.voltage = int(voltage)
+        self.source = source
+        self.time = float(time)
+        self.settings = settings
+        self.rate = rate
+        self.variance = variance
+        self.smoothed = smoothed
+        self.smoothed_variance = smoothed_variance
+        self.knots = knots
+        self.coefficients = coefficients
+        self.degree = int(degree)
+
+    # template of counts taken during time, smoothed with method "spline" (splrep
+    # with smoothing for the counts normalised to reference_time) or "whittaker"
+    # (lam = smoothing, None for GCV); bins 0..n-1 are smoothed as in get_draw_spline
+    @classmethod
+    def from_counts(cls, counts, time, detector, gain, voltage, source="", method="spline", smoothing=0.002, reference_time=1.):
+        settings = {'method': method, 'smoothing': smoothing, 'reference_time': float(reference_time)}
+        y = with_underflow(counts)
+        x = channel_centres(len(counts))
+        rate, variance = y/time, y/time**2
+        knots, coefficients, degree = None, None, 3
+        if method == "spline":
+            spline = smoothing_spline(x[:-1], (rate*reference_time)[:-1], smoothing)
+            spline.c /= reference_time
+            knots, coefficients, degree = spline.t, spline.c, spline.k
+            smoothed = spline(x)
+            smoothed_variance = spline_variance(spline, x[:-1], variance[:-1], x)
+        elif method == "whittaker":
+            from whittaker import whittaker_smooth, whittaker_variance, gcv_smooth
+            if smoothing is None:
+                z, lam = gcv_smooth(rate[:-1])
+            else:
+                z, lam = whittaker_smooth(rate[:-1], smoothing), smoothing
+            smoothed, smoothed_variance = np.full(len(x), np.nan), np.full(len(x), np.nan)
+            smoothed[:-1], smoothed_variance[:-1] = z, whittaker_variance(variance[:-1], lam)
+            settings['lam'] = float(lam)
+        else:
+            raise ValueError("unknown smoothing method {:}, use spline or whittaker".format(method))
+        outside = np.isnan(smoothed)
+        smoothed[outside], smoothed_variance[outside] = rate[outside], variance[outside]
+        return cls(detector, gain, voltage, source, time, settings, rate[1:], variance[1:], smoothed[1:],
+                   np.clip(smoothed_variance[1:], 0., None), knots, coefficients, degree)
+
+    @property
+    def n_channels(self):
+        return len(self.rate)
+
+    # smoothed background counts per channel expected in time (scalar, or one per
+    # run giving shape (n_runs, n))
+    def expected(self, time):
+        return np.multiply.outer(time, self.smoothed)
+
+    # counts (shape (n,) or (n_runs, n)) taken during time (scalar or one per run)
+    # minus the background of that time, clipped at zero like subtract_bkg
+    # returns contents and errors of channels 1..n
+    def subtract(self, counts, time, clip=True):
+        counts = np.asarray(counts, dtype=np.float64)
+        time = np.asarray(time, dtype=np.float64)
+        if time.ndim:
+            time = time[:, None]
+        values = counts - time*self.smoothed
+        errors = np.sqrt(counts + time**2*self.smoothed_variance)
+        return (np.fmax(values, 0.) if clip else values), errors
+
+    # the smoothed background of time as a function of x, like the splines of
+    # get_draw_spline (nan outside), for subtract_bkg
+    def function(self, time=1.):
+        if self.knots is not None:
+            from scipy.interpolate import BSpline
+            return BSpline(self.knots, self.coefficients*time, self.degree, extrapolate=False)
+        from whittaker import smoothed_function
+        return smoothed_function(channel_centres(self.n_channels)[1:-1], self.smoothed[:-1]*time)
+
+    def save(self, path, stamp):
+        arrays = dict((k, getattr(self, k)) for k in self.array_fields if getattr(self, k) is not None)
+        info = {'version': TEMPLATE_VERSION, 'stamp': stamp, 'detector': self.detector, 'gain': self.gain,
+                'voltage': self.voltage, 'source': self.source, 'time': self.time, 'settings': self.settings,
+                'degree': self.degree}
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path + '.tmp.npz', 'wb') as f:
+                np.savez(f, **arrays)
+            with open(path + '.json.tmp', 'w') as f:
+                json.dump(info, f)
+            # the arrays first, the json marks a complete entry
+            _replace(path + '.tmp.npz', path + '.npz')
+            _replace(path + '.json.tmp', path + '.json')
+        except (IOError, OSError):
+            # a read-only checkout still works, just without stored templates
+            pass
+
+    # stored template and its json record, None if there is none
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path + '.json') as f:
+                info = json.load(f)
+            with np.load(path + '.npz') as data:
+                arrays = dict((k, data[k]) for k in data.files)
+        except (IOError, OSError, ValueError):
+            return None, None
+        template = cls(info['detector'], info['gain'], info['voltage'], info['source'], info['time'], info['settings'],
+                       degree=info['degree'], **arrays)
+        return template, info
+
+    def __repr__(self):
+        return "BackgroundTemplate({:}, gain {:d}, {:d} V, {:.1f} s of {:})".format(
+            self.detector, self.gain, self.voltage, self.time, os.path.basename(self.source))
+
+
+class BackgroundTemplates(object):
+    """
+    Templates of the background runs (source 'bkg') found in directories, by
+    (detector, gain, voltage). clock is the time the rates are normalised to,
+    'live_time' or 'status_real_time' (what mca_to_hist and the scripts use).
+    """
+    __slots__ = ('catalog', 'directory', 'clock', 'method', 'smoothing', 'reference_time', 'templates')
+
+    def __init__(self, directories=("../data/mca", "../data/mcapipe"), cache_dir=None, clock='live_time',
+                 method="spline", smoothing=0.002, reference_time=1.):
+        self.catalog = RunCatalog.from_directories(directories)
+        self.directory = cache_dir or BACKGROUND_DIR
+        self.clock = clock
+        self.method = method
+        self.smoothing = smoothing
+        self.reference_time = reference_time
+        self.templates = {}
+
+    def _settings(self):
+        return {'clock': self.clock, 'method': self.method, 'smoothing': self.smoothing, 'reference_time': float(self.reference_time)}
+
+    def _path(self, detector, gain, voltage):
+        return os.path.join(self.directory, "{:}_{:d}_{:d}".format(detector, gain, voltage))
+
+    # path of the background run of detector, gain and voltage
+    def source(self, detector, gain, voltage):
+        rows = self.catalog.select(source='bkg', gain=gain, voltage=voltage, detector=detector)
+        if not len(rows):
+            raise ValueError("no background run for the {:} at gain {:d} and {:d} V".format(detector, gain, voltage))
+        return rows['path'][0]
+
+    # template of detector, gain and voltage: from memory, from disk if the
+    # background run and the settings did not change, or built from the run
+    def get(self, detector, gain, voltage):
+        key = (str(detector), int(gain), int(voltage))
+        if key in self.templates:
+            return self.templates[key]
+        filename = self.source(*key)
+        path = self._path(*key)
+        stamp = [os.path.abspath(filename)] + source_stamp(filename)
+        settings = self._settings()
+        template, info = BackgroundTemplate.load(path)
+        if template is None or info.get('version') != TEMPLATE_VERSION or info.get('stamp') != stamp or \
+           dict((k, template.settings.get(k)) for k in settings) != settings:
+            counts, meta = load_mca(filename)
+            template = BackgroundTemplate.from_counts(counts, getattr(meta, self.clock), *key, source=filename,
+                                                      method=self.method, smoothing=self.smoothing,
+                                                      reference_time=self.reference_time)
+            template.settings['clock'] = self.clock
+            template.save(path, stamp)
+        self.templates[key] = template
+        return template
+
+    # template for a signal run, by its file name
+    def for_run(self, filename):
+        _, gain, voltage, detector, _ = parse_run_name(filename)
+        return self.get(detector, gain, voltage)
+
+    # templates of all background runs
+    def build(self):
+        keys = sorted(set(zip(*[self.catalog.select(source='bkg')[c] for c in ('detector', 'gain', 'voltage')])))
+        return [self.get(*key) for key in keys]
+
+    # stored templates as (name, record)
+    def stored(self):
+        entries = []
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.json'))):
+            with open(path) as f:
+                entries.append((os.path.splitext(os.path.basename(path))[0], json.load(f)))
+        return entries
+
+    def clear(self):
+        n = len(self.stored())
+        self.templates = {}
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        return n
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Build, list or clear the background templates")
+    parser.add_argument('command', choices=['build', 'list', 'clear'])
+    parser.add_argument('--data', nargs='+', default=["../data/mca", "../data/mcapipe"])
+    parser.add_argument('--cache-dir', default=None, help='default: {:}'.format(BACKGROUND_DIR))
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArguments(argv)
+    templates = BackgroundTemplates(args.data, args.cache_dir)
+    if args.command == 'build':
+        t0 = time.time()
+        built = templates.build()
+        elapsed = time.time() - t0
+        for template in built:
+            print(template)
+        # every signal run of a setting with a template, minus its background
+        runs = templates.catalog.runs
+        index = [i for i, r in enumerate(runs) if r['source'] != 'bkg' and
+                 (r['detector'], int(r['gain']), int(r['voltage'])) in templates.templates]
+        counts, loaded = templates.catalog.load(index)
+        t1 = time.time()
+        for c, run in zip(counts, loaded):
+            templates.for_run(run['filename']).subtract(c, run['live_time'])
+        print("{:d} templates in {:.2f} s, {:d} signal runs subtracted in {:.2f} ms".format(
+            len(built), elapsed, len(loaded), (time.time() - t1)*1e3))
+    elif args.command == 'list':
+        for name, info in templates.stored():
+            print("{:16s} {:8.1f} s  {:} {:}".format(name, info['time'], os.path.basename(info['source']), info['settings']))
+    elif args.command == 'clear':
+        print("removed {:d} templates".format(templates.clear()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
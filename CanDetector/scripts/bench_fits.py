@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the fits in fit_spectra_can.py with the NumPy backend and,
+if ROOT is available, with the Minuit backend on the same histograms.
+The ROOT fits use the compiled TFormula of each model, --callback times
+them with the python function called for every bin instead.
+
+    ./bench_fits.py --repeat 20
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+
+from mca_cache import load_mca
+from fit_numpy import fit_arrays
+from bkg_subtraction import subtract_background
+from fit_models import gauss_single, gauss_double_uncorr, gauss_p1, gauss_quad_p2
+
+
+# same steps as get_draw_spline + subtract_bkg in fit_spectra_common,
+# returns bin centres and background subtracted contents of bins 1..n
+def subtracted_spectrum(fname, fname_bkg, time_to_norm_to, smoothing_strength=0.02, smoothing_bkg=0.002):
+    counts, meta = load_mca(fname)
+    counts_bkg, meta_bkg = load_mca(fname_bkg)
+    x, y, _ = subtract_background(counts, time_to_norm_to/meta.status_real_time, counts_bkg,
+                                  time_to_norm_to/meta_bkg.status_real_time, smoothing_strength, smoothing_bkg)
+    return x, y
+
+# the fits of fit_spectra_can.py as (name, which spectrum, model, start values, range, bounds),
+# the combined 4-peak fit starts from the start values of the single peak fits
+def can_fits():
+    fits = [("fe escape",  'fe', gauss_single, [48, 46.4, 5.9], [37, 50], None),
+            ("fe K-a/K-b", 'fe', gauss_double_uncorr, [800, 0.88, 90.2, 7.04, 99.1, 4.04], [70, 120], None),
+            ("am main",    'am', gauss_single, [5116, 882, 22], [865, 920], None),
+            ("am 262",     'am', gauss_p1, [130, 262, 9.3, 28.7, -0.0325], [240, 285], None),
+            ("am 318",     'am', gauss_p1, [47.5, 317.77, 5.92, 20.6, 0.00479], [300, 335], None),
+            ("am 394",     'am', gauss_p1, [904, 394, 14.56, 87, -0.183], [360, 415], None),
+            ("am 181",     'am', gauss_p1, [4190, 180.97, 14.92, 87, -0.2], [175, 216],
+             ([1000, 170, 5, 0, -0.3], [10000, 190, 20, 200, 1]))]
+    peaks = [[130, 262, 9.3], [47.5, 317.77, 5.92], [904, 394, 14.56], [4190, 180.97, 14.92]]
+    start = sum(peaks, []) + [20, -0.001, 0]
+    lower, upper = [], []
+    for c, m, s in peaks:
+        lower += [c*0.8, m*0.8, s*0.8]
+        upper += [c*1.2, m*1.2, s*1.2]
+    lower[0], upper[0], lower[2] = 60, 1000, peaks[0][2]*0.8*2
+    upper[3], upper[5] = peaks[1][0]*1.2*100, peaks[1][2]*1.2*0.5
+    lower += [0.0, -1.0, 0.000000001]
+    upper += [100, -0.001, 0.000000001]
+    fits.append(("am 4 peaks", 'am', gauss_quad_p2, start, [175, 450], (lower, upper)))
+    return fits
+
+
+def time_fit(fit, repeat):
+    fit()
+    t0 = time.time()
+    for i in range(repeat):
+        result = fit()
+    return (time.time() - t0)/repeat, result
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Time the spectrum fits with the NumPy and ROOT backends")
+    parser.add_argument('-n', '--repeat', type=int, default=10)
+    parser.add_argument('--likelihood', action='store_true', help='Poisson likelihood instead of chi2')
+    parser.add_argument('--callback', action='store_true', help='ROOT fits through the python function instead of its TFormula')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArguments(argv)
+    time_fe = load_mca("../data/mca/fe_4_1937_spectrum.mca")[1].status_real_time
+    spectra = {'fe': subtracted_spectrum("../data/mca/fe_4_1937_spectrum.mca", "../data/mca/bkg_4_1937_spectrum.mca", time_fe),
+               'am': subtracted_spectrum("../data/mca/am_4_1937_spectrum.mca", "../data/mca/bkg_4_1937_spectrum.mca", time_fe)}
+    try:
+        import ROOT
+        import fit_spectra_common
+        from fit_spectra_common import fit_and_draw_ROOT
+        fit_spectra_common.use_formula = not args.callback
+        ROOT.gErrorIgnoreLevel = ROOT.kWarning
+        hists = {}
+        for k, (x, y) in spectra.items():
+            hists[k] = ROOT.TH1D("bench_"+k, k, len(x), x[0]-0.5, x[-1]+0.5)
+            for i, v in enumerate(y):
+                hists[k].SetBinContent(i+1, v)
+    except ImportError:
+        hists = None
+        print("ROOT not available, timing the numpy backend only")
+
+    options = "RSLQ" if args.likelihood else "RSQ"
+    print("{:12s} {:>4s} {:>10s} {:>14s} {:>10s} {:>14s} {:>10s}".format(
+        "fit", "npar", "numpy [ms]", "chi2/ndof", "ROOT [ms]", "chi2/ndof", "max |dp|/err"))
+    for name, which, func, start, xrange, bounds in can_fits():
+        x, y = spectra[which]
+        t_np, (pars, errs, chi2, ndof, prob) = time_fit(
+            lambda: fit_arrays(x, y, func, start, xrange, bounds, likelihood=args.likelihood), args.repeat)
+        line = "{:12s} {:4d} {:10.2f} {:>14s}".format(name, len(start), t_np*1e3, "{:.1f}/{:d}".format(chi2, ndof))
+        if hists is not None:
+            t_root, (pars_r, errs_r, chi2_r, ndof_r, _) = time_fit(
+                lambda: fit_and_draw_ROOT(hists[which], func, start, None, xrange, True, bounds=bounds,
+                                          dont_draw_fit=True, fitoptions=options, use_cache=False), args.repeat)
+            pull = max(abs(a-b)/e for a, b, e in zip(pars, pars_r, errs_r) if e > 0)
+            line += " {:10.2f} {:>14s} {:10.3f}".format(t_root*1e3, "{:.1f}/{:d}".format(chi2_r, ndof_r), pull)
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fit one PeakModel to many spectra at once.
+
+The spectra are stacked into an (n_spectra, n_channels) array; every row
+has its own fit range and start values. All rows are iterated together
+with a vectorised Levenberg-Marquardt, so the Python overhead is paid once
+per iteration rather than once per fit. The chi² and likelihood follow the
+conventions of fit_numpy (and ROOT).
+
+    ./fit_batch.py                      # the HV scan, one Gaussian per ROI
+    ./fit_batch.py --synthetic 10000    # throughput on simulated spectra
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+from scipy.stats import chi2 as chi2_distribution
+
+from fit_models import gauss_single
+
+
+# only the bins inside the range of each row are used, gathered into windows
+# of equal width so that every row is an (n, width) array: returns the channel
+# index of every window bin and whether it lies inside the range of its row
+def windows(x, xrange):
+    selected = (x >= xrange[:, :1]) & (x <= xrange[:, 1:])
+    first = np.argmax(selected, axis=1)
+    n_inside = selected.sum(axis=1)
+    width = max(int(n_inside.max()), 1)
+    index = np.clip(first[:, None] + np.arange(width), 0, len(x)-1)
+    return index, np.take_along_axis(selected, index, axis=1) & (np.arange(width) < n_inside[:, None])
+
+# fit model to every row of y (bin contents at bin centres x)
+# startval has shape (n_spectra, npar) or (npar,), xrange (n_spectra, 2) or (2,)
+# likelihood fits use poisson_nll.PoissonNLL, with threads > 1 its channel blocks
+# are summed in parallel
+# returns pars and errs (n_spectra, npar), chi2, ndof, prob (percent) and a
+# flag per row whether the fit converged, with return_cov also the covariance
+# matrices (n_spectra, npar, npar)
+def fit_batch(y, model, startval, xrange, x=None, likelihood=False, max_iter=200, tol=1e-7, return_cov=False, threads=1):
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    n, n_channels = y.shape
+    x = np.arange(n_channels) + 0.5 if x is None else np.asarray(x, dtype=np.float64)
+    pars = np.array(np.broadcast_to(np.asarray(startval, dtype=np.float64), (n, model.npar)))
+    xrange = np.broadcast_to(np.asarray(xrange, dtype=np.float64), (n, 2))
+
+    # objective(p, rows) gives the value, g = J w (y - f) and A = J w J^T of the rows,
+    # with weights w = 1/sigma² (1/f for the likelihood) of the bins taking part
+    if likelihood:
+        from poisson_nll import PoissonNLL
+        nll = PoissonNLL(model, y, xrange, x, threads)
+        n_bins = nll.n_bins
+        def objective(p, rows):
+            value, gradient, curvature = nll.value_gradient_curvature(p, rows)
+            return value, -gradient/2, curvature/2
+    else:
+        index, selected = windows(x, xrange)
+        x, y = x[index], np.take_along_axis(y, index, axis=1)
+        selected &= y > 0
+        n_bins = selected.sum(axis=1)
+        w_fixed = np.where(selected, 1./np.where(selected, y, 1.), 0.)
+        def objective(p, rows):
+            f, jac = model.gradient(x[rows], p, rows=True)
+            w = w_fixed[rows]
+            jw = jac*w[:, None, :]
+            r = y[rows] - f
+            return (w*r**2).sum(axis=1), np.einsum('ipk,ik->ip', jw, r), np.einsum('ipk,iqk->ipq', jw, jac)
+
+    lam = np.full(n, 1e-3)
+    active = np.ones(n, dtype=bool)
+    converged = np.zeros(n, dtype=bool)
+    value, g, A = objective(pars, slice(None))
+    for iteration in range(max_iter):
+        rows = np.flatnonzero(active)
+        if len(rows) == 0:
+            break
+        # Gauss-Newton normal equations of every active row with a damped diagonal
+        diag = np.einsum('ipp->ip', A[rows])
+        A_damped = A[rows] + (lam[rows, None]*np.where(diag > 0, diag, 1.))[:, :, None]*np.eye(model.npar)
+        try:
+            step = np.linalg.solve(A_damped, g[rows][..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.array([np.linalg.lstsq(a, b, rcond=None)[0] for a, b in zip(A_damped, g[rows])])
+
+        trial = pars[rows] + step
+        value_new, g_new, A_new = objective(trial, rows)
+        better = np.isfinite(value_new) & (value_new <= value[rows])
+        accepted = rows[better]
+        done = better & (value[rows] - value_new <= tol*(1 + value_new))
+        pars[accepted] = trial[better]
+        value[accepted] = value_new[better]
+        g[accepted], A[accepted] = g_new[better], A_new[better]
+        lam[rows] = np.where(better, lam[rows]/10., lam[rows]*10.)
+        converged[rows[done]] = True
+        # rows that cannot improve any more are finished as well
+        active[rows[done | (lam[rows] > 1e10)]] = False
+    if likelihood:
+        nll.close()
+
+    # errors from the curvature at the minimum (UP = 1 for chi² and -2 ln L)
+    cov = np.full(A.shape, np.nan)
+    for i in range(n):
+        try:
+            cov[i] = np.linalg.inv(A[i])
+        except np.linalg.LinAlgError:
+            pass
+    with np.errstate(invalid='ignore'):
+        errs = np.sqrt(np.einsum('ipp->ip', cov))
+    ndof = n_bins - model.npar
+    prob = np.where(ndof > 0, chi2_distribution.sf(value, np.clip(ndof, 1, None))*100, 0.)
+    if return_cov:
+        return pars, errs, value, ndof, prob, converged, cov
+    return pars, errs, value, ndof, prob, converged
+
+# fit_batch with the results kept in a fit_cache.FitCache: rows fitted before are
+# read back, the others are fitted together, each starting from the nearest cached
+# result of the same range where that describes the row better than startval
+# returns pars, errs, chi2, ndof, prob, converged and cov like fit_batch(..., return_cov=True)
+def cached_fit_batch(y, model, startval, xrange, x=None, likelihood=False, cache=None):
+    from fit_cache import FitCache, fit_family, fit_key, fit_window, fit_record, start_chi2, result_fields
+    cache = cache or FitCache()
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    n = len(y)
+    x = np.arange(y.shape[1]) + 0.5 if x is None else np.asarray(x, dtype=np.float64)
+    startval = np.array(np.broadcast_to(np.asarray(startval, dtype=np.float64), (n, model.npar)))
+    xrange = np.broadcast_to(np.asarray(xrange, dtype=np.float64), (n, 2))
+    options = "batch:" + ("likelihood" if likelihood else "chi2")
+
+    families = [fit_family(model, r, None, options) for r in xrange]
+    keys = [fit_key(f, x, row) for f, row in zip(families, y)]
+    records = [cache.get(f, k) for f, k in zip(families, keys)]
+    missing = [i for i, r in enumerate(records) if r is None]
+    if missing:
+        windows_y = [fit_window(x, y[i], xrange[i]) for i in missing]
+        for i, window in zip(missing, windows_y):
+            warm = cache.nearest(families[i], window)
+            if warm is not None and start_chi2(model, warm, x, y[i], xrange[i]) < start_chi2(model, startval[i], x, y[i], xrange[i]):
+                startval[i] = warm
+        pars, errs, chi2, ndof, prob, converged, cov = fit_batch(y[missing], model, startval[missing], xrange[missing], x,
+                                                                likelihood, return_cov=True)
+        for j, (i, window) in enumerate(zip(missing, windows_y)):
+            records[i] = fit_record((pars[j], errs[j], chi2[j], ndof[j], prob[j], cov[j]), model, xrange[i], options, window)
+            records[i]['converged'] = bool(converged[j])
+            cache.put(families[i], keys[i], records[i])
+    pars, errs, chi2, ndof, prob, cov = [np.array([r[k] for r in records], dtype=np.float64).reshape((n,) + s)
+                                         for k, s in zip(result_fields, [(model.npar,), (model.npar,), (), (), (), (model.npar, model.npar)])]
+    converged = np.array([r.get('converged', True) for r in records], dtype=bool)
+    return pars, errs, chi2, ndof.astype(int), prob, converged, cov
+
+# fit range of every run from its ROI; runs without ROI (e.g. cal_10_12) get the
+# whole spectrum of n_channels, as ROOT fits the whole histogram for an empty range
+def roi_ranges(runs, n_channels):
+    xrange = np.column_stack([runs['roi_min'], runs['roi_max']]).astype(np.float64)
+    xrange[xrange[:, 1] <= xrange[:, 0]] = [0, n_channels]
+    return xrange
+
+# Gaussian fit to the ROI of every HV-scan run of source ('fe', 'am' or 'cal') in
+# data, what plot_HVscan does run by run with a "gaus" likelihood fit; runs without
+# ROI are fitted over the whole spectrum, as ROOT does for an empty range.
+# The results are cached. Returns runs (ordered by gain and voltage), pars and errs
+def fit_scan(source, data="../data/mca", likelihood=True, cache=None):
+    from mca_runs import RunCatalog
+    from gauss_seed import gauss_seed
+    catalog = RunCatalog.from_directories([data])
+    counts, runs = catalog.load(catalog.select_index(source=source, kind='scan'))
+    y = counts.astype(np.float64)
+    xrange = roi_ranges(runs, y.shape[1])
+    start = gauss_seed(y, xrange)
+    pars, errs = cached_fit_batch(y, gauss_single, start, xrange, likelihood=likelihood, cache=cache)[:2]
+    return runs, pars, errs
+
+
+# spectra with one Gaussian peak on a flat background, Poisson fluctuated
+def synthetic_spectra(n, n_channels=1024, seed=42):
+    rng = np.random.RandomState(seed)
+    x = np.arange(n_channels) + 0.5
+    area = rng.uniform(1e3, 1e5, n)
+    mean = rng.uniform(100, n_channels-100, n)
+    sigma = rng.uniform(5, 30, n)
+    truth = np.column_stack([area, mean, sigma])
+    expected = gauss_single.evaluate(x, truth) + rng.uniform(0, 2, n)[:, None]
+    y = rng.poisson(expected).astype(np.float64)
+    xrange = np.column_stack([mean - 1.5*sigma, mean + 1.5*sigma])
+    return y, truth, xrange
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Batch Gaussian fits of the HV scan or of simulated spectra")
+    parser.add_argument('--synthetic', type=int, default=0, help='fit this many simulated spectra instead of the HV scan')
+    parser.add_argument('--likelihood', action='store_true', help='Poisson likelihood (as `LL` in plot_HVscan) instead of chi2')
+    parser.add_argument('--threads', type=int, default=1, help='threads summing the likelihood over blocks of channels')
+    parser.add_argument('--data', default="../data/mca")
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArguments(argv)
+    if args.synthetic:
+        y, truth, xrange = synthetic_spectra(args.synthetic)
+        labels = None
+    else:
+        from mca_runs import load_run_directory
+        counts, runs = load_run_directory(args.data)
+        scan = runs['kind'] == 'scan'
+        y, runs = counts[scan].astype(np.float64), runs[scan]
+        xrange = roi_ranges(runs, y.shape[1])
+        labels = runs['filename']
+
+    from gauss_seed import gauss_seed
+    x = np.arange(y.shape[1]) + 0.5
+    t0 = time.time()
+    start = gauss_seed(y, xrange, x)
+    pars, errs, chi2, ndof, prob, converged = fit_batch(y, gauss_single, start, xrange, x, args.likelihood, threads=args.threads)
+    elapsed = time.time() - t0
+
+    if labels is not None:
+        fwhm = pars[:, 2]*2.*np.sqrt(2*np.log(2))
+        for i in np.argsort(labels):
+            print("{:24s} mean {:8.2f} ± {:5.2f}  FWHM {:7.2f}  chi2/ndof {:7.1f}/{:3d}{:}".format(
+                labels[i], pars[i, 1], errs[i, 1], abs(fwhm[i]), chi2[i], ndof[i], "" if converged[i] else "  (not converged)"))
+    else:
+        pull = (pars[:, 1] - truth[:, 1])/errs[:, 1]
+        print("mean pull: {:.3f} ± {:.3f}".format(np.nanmean(pull), np.nanstd(pull)))
+    print("{:d} fits in {:.3f} s: {:.0f} fits/s, {:d} not converged".format(
+        len(y), elapsed, len(y)/elapsed, int((~converged).sum())))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
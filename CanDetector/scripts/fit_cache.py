@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of fit results, addressed by the content of the fit.
+
+A fit is identified by its family (model, range, bounds and options) and
+by the histogram (bin centres and contents). Each result is a small `.json`
+file with parameters, errors, covariance, chi², ndof and probability under
+`<cache dir>/fits/<family>/<histogram>.json`; unchanged inputs give the
+stored result back without fitting. On a miss the fit can start from the
+result of the most similar histogram of the same family, if that describes
+the new data better than the given start values.
+
+    cache = FitCache()
+    result = cached_fit(run, x, y, gauss_p1, startval, [240, 285], cache=cache)
+
+    ./fit_cache.py list
+    ./fit_cache.py clear
+"""
+
+import os
+import sys
+import json
+import glob
+import shutil
+import hashlib
+import argparse
+import numpy as np
+
+from mca_cache import CACHE_DIR
+
+FIT_CACHE_DIR = os.environ.get('FIT_CACHE_DIR', os.path.join(CACHE_DIR, 'fits'))
+
+# bumped whenever the key or the stored record changes
+FIT_CACHE_VERSION = 1
+
+_replace = getattr(os, 'replace', os.rename)
+result_fields = ('pars', 'errs', 'chi2', 'ndof', 'prob', 'cov')
+
+
+# name of a model that changes when the model does: the repr of a PeakModel, the
+# expression of a TFormula string, or name and byte code of a plain function
+def model_id(func):
+    if not callable(func):
+        return str(func)
+    if hasattr(func, 'names'):
+        return repr(func)
+    code = getattr(func, '__code__', None)
+    digest = hashlib.sha1(code.co_code + repr(code.co_consts).encode('utf-8')).hexdigest()[:12] if code else ''
+    return "{:}.{:}:{:}".format(getattr(func, '__module__', ''), getattr(func, '__name__', repr(func)), digest)
+
+def _sha1(*parts):
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else json.dumps(p, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+# everything about a fit except the data
+def fit_family(func, xrange, bounds=None, options=""):
+    bounds = None if bounds is None else [[float(v) for v in b] for b in bounds]
+    return _sha1(FIT_CACHE_VERSION, model_id(func), [float(v) for v in xrange], bounds, options)
+
+def fit_key(family, x, y):
+    return _sha1(family, np.ascontiguousarray(x, dtype=np.float64).tobytes(),
+                 np.ascontiguousarray(y, dtype=np.float64).tobytes())
+
+# contents of the bins inside xrange, compared to find the nearest cached histogram
+def fit_window(x, y, xrange):
+    x = np.asarray(x, dtype=np.float64)
+    return np.asarray(y, dtype=np.float64)[(x >= xrange[0]) & (x <= xrange[1])]
+
+def _to_list(a):
+    return np.asarray(a, dtype=np.float64).tolist()
+
+
+class FitCache(object):
+    """
+    Fit results in one directory per family, one json file per histogram.
+    """
+    __slots__ = ('directory',)
+
+    def __init__(self, directory=None):
+        self.directory = directory or FIT_CACHE_DIR
+
+    def _path(self, family, key):
+        return os.path.join(self.directory, family, key + '.json')
+
+    # the stored record (result_fields plus the description of the fit) or None
+    def get(self, family, key):
+        try:
+            with open(self._path(family, key)) as f:
+                record = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        return record if record.get('version') == FIT_CACHE_VERSION else None
+
+    def put(self, family, key, record):
+        path = self._path(family, key)
+        record = dict(record, version=FIT_CACHE_VERSION)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            # written under a temporary name first, a crash never leaves half a record
+            with open(path + '.tmp', 'w') as f:
+                json.dump(record, f)
+            _replace(path + '.tmp', path)
+        except (IOError, OSError):
+            # a read-only checkout still works, just without caching
+            pass
+
+    # parameters of the record of this family whose window is closest to window
+    # (Neyman chi² distance over windows of equal length), None if there is none
+    def nearest(self, family, window):
+        best, best_distance = None, np.inf
+        for path in glob.glob(os.path.join(self.directory, family, '*.json')):
+            try:
+                with open(path) as f:
+                    record = json.load(f)
+            except (IOError, OSError, ValueError):
+                continue
+            other = np.asarray(record.get('window', []), dtype=np.float64)
+            if record.get('version') != FIT_CACHE_VERSION or len(other) != len(window):
+                continue
+            distance = np.sum((other - window)**2/np.clip(other + window, 1, None))
+            if distance < best_distance:
+                best, best_distance = record['pars'], distance
+        return best
+
+    # (family, number of records, model, range, options) for every family
+    def families(self):
+        families = []
+        for d in sorted(glob.glob(os.path.join(self.directory, '*'))):
+            records = glob.glob(os.path.join(d, '*.json'))
+            if not records:
+                continue
+            with open(records[0]) as f:
+                record = json.load(f)
+            families.append((os.path.basename(d), len(records), record.get('model'), record.get('xrange'), record.get('options')))
+        return families
+
+    def clear(self):
+        n = sum(f[1] for f in self.families())
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        return n
+
+
+# chi² of func with pars on the bins inside xrange, to compare start values
+def start_chi2(func, pars, x, y, xrange):
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    selected = (x >= xrange[0]) & (x <= xrange[1]) & (y > 0)
+    with np.errstate(all='ignore'):
+        chi2 = np.sum((func(x[selected], *pars) - y[selected])**2/y[selected])
+    return chi2 if np.isfinite(chi2) else np.inf
+
+# the record stored for result = (pars, errs, chi2, ndof, prob, cov)
+def fit_record(result, func, xrange, options, window):
+    record = dict(zip(result_fields, [_to_list(result[0]), _to_list(result[1]), float(result[2]),
+                                      int(result[3]), float(result[4]), _to_list(result[5])]))
+    record.update(model=model_id(func), xrange=_to_list(xrange), options=options, window=_to_list(window))
+    return record
+
+# result of fit(startval) -> (pars, errs, chi2, ndof, prob, cov) for func fitted to y at x,
+# from the cache if this fit was done before; otherwise the fit starts from the
+# nearest cached result of the same family if that is closer to the data than startval
+# returns a dict with the keys of result_fields
+def cached_fit(fit, x, y, func, startval, xrange, bounds=None, options="", cache=None):
+    cache = cache or FitCache()
+    family = fit_family(func, xrange, bounds, options)
+    key = fit_key(family, x, y)
+    record = cache.get(family, key)
+    if record is not None:
+        return record
+
+    window = fit_window(x, y, xrange)
+    warm = cache.nearest(family, window)
+    if warm is not None and callable(func) and len(warm) == len(startval) and \
+       start_chi2(func, warm, x, y, xrange) < start_chi2(func, startval, x, y, xrange):
+        startval = warm
+    record = fit_record(fit(startval), func, xrange, options, window)
+    cache.put(family, key, record)
+    return record
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the cache of fit results")
+    parser.add_argument('command', choices=['list', 'clear'])
+    parser.add_argument('--cache-dir', default=None, help='default: {:}'.format(FIT_CACHE_DIR))
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArguments(argv)
+    cache = FitCache(args.cache_dir)
+    if args.command == 'list':
+        for family, n, model, xrange, options in cache.families():
+            print("{:} {:5d} fits  {:} {:} {:}".format(family[:12], n, model, xrange, options))
+    elif args.command == 'clear':
+        print("removed {:d} fits".format(cache.clear()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Peak models used by the spectrum fits: sums of normalised Gaussians
+(c = area, m = mean, s = sigma) on top of an optional background.
+Only NumPy is needed, so the models can be used without ROOT.
+
+PeakModel composes "k Gaussians + polynomial of degree d (+ exponential)";
+the gauss_* models below are instances of it:
+
+    gauss_quint_p1 = PeakModel(5, 1)
+    y = gauss_quint_p1(x, c0, m0, s0, ..., c4, m4, s4, p0, p1)
+
+formula(model) gives the same model as a TFormula expression, which ROOT
+compiles instead of calling back into Python for every bin.
+"""
+
+import numpy as np
+from math import exp, pi, sqrt
+from inspect import signature
+
+_sqrt2pi = np.sqrt(2*np.pi)
+_sqrt2pi_literal = "{:.17g}".format(_sqrt2pi)
+
+
+class PeakModel(object):
+    """
+    n_gauss Gaussians, a polynomial of the given degree (-1 for none) and
+    optionally e0*exp(-x*t0), with the parameters in the order
+
+        c0, m0, s0, c1, m1, s1, ..., p0, p1, ..., e0, t0
+
+    Called like the plain functions, model(x, *pars); evaluate, gradient
+    and components take the parameters as one array and work on whole
+    arrays of x.
+    """
+    __slots__ = ('n_gauss', 'degree', 'exponential', 'npar', 'names')
+
+    def __init__(self, n_gauss, degree=-1, exponential=False):
+        self.n_gauss = n_gauss
+        self.degree = degree
+        self.exponential = exponential
+        self.names = tuple(n+str(k) for k in range(n_gauss) for n in 'cms') + \
+                     tuple('p'+str(k) for k in range(degree+1)) + (('e0', 't0') if exponential else ())
+        self.npar = len(self.names)
+
+    def __repr__(self):
+        return "PeakModel({:d}, {:d}, exponential={:})".format(self.n_gauss, self.degree, self.exponential)
+
+    # models with the same terms are equal, also a copy sent to another process
+    def __eq__(self, other):
+        return isinstance(other, PeakModel) and repr(self) == repr(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(repr(self))
+
+    def __call__(self, x, *pars):
+        if np.ndim(x) == 0:
+            return self._evaluate_point(float(x), pars)
+        return self.evaluate(x, pars)
+
+    # plain python for a single point, as called per bin by a ROOT.TF1
+    def _evaluate_point(self, x, pars):
+        value = 0.
+        for i in range(0, 3*self.n_gauss, 3):
+            c, m, s = pars[i], pars[i+1], pars[i+2]
+            value += c/(sqrt(2*pi)*s)*exp(-(x-m)**2/(2*s**2))
+        k = 3*self.n_gauss
+        poly = 0.
+        for c in reversed(pars[k:k+self.degree+1]):
+            poly = poly*x + c
+        value += poly
+        if self.exponential:
+            value += pars[-2]*exp(-x*pars[-1])
+        return value
+
+    # split pars (shape batch + (npar,)) into c, m, s of shape batch + (1,)*ndim + (n_gauss,)
+    # and polynomial and exponential coefficients of shape batch + (1,)*ndim, so
+    # that they broadcast against x with ndim dimensions
+    def _split(self, pars, ndim):
+        pars = np.asarray(pars, dtype=np.float64)
+        batch = pars.shape[:-1]
+        k = 3*self.n_gauss
+        g = pars[..., :k].reshape(batch + (1,)*ndim + (self.n_gauss, 3))
+        rest = pars[..., k:].reshape(batch + (1,)*ndim + (-1,))
+        poly = [rest[..., j] for j in range(self.degree+1)]
+        ex = [rest[..., j] for j in range(self.degree+1, rest.shape[-1])]
+        return g[..., 0], g[..., 1], g[..., 2], poly, ex, len(batch)
+
+    def _polynomial(self, x, poly):
+        value = np.zeros_like(x)
+        for c in poly[::-1]:
+            value = value*x + c
+        return value
+
+    # a batch of parameter sets (shape (n, npar)) gives results of shape (n,) + x.shape;
+    # with rows=True x has the batch shape in front, every parameter set gets its own x
+    def evaluate(self, x, pars, rows=False):
+        x = np.asarray(x, dtype=np.float64)
+        c, m, s, poly, ex, _ = self._split(pars, x.ndim - (np.ndim(pars)-1 if rows else 0))
+        value = (c/(_sqrt2pi*s)*np.exp(-(x[..., None]-m)**2/(2*s**2))).sum(axis=-1)
+        if self.degree >= 0:
+            value = value + self._polynomial(x, poly)
+        if self.exponential:
+            value = value + ex[0]*np.exp(-x*ex[1])
+        return value
+
+    # value and derivatives, the Jacobian has shape batch + (npar,) + x.shape
+    def gradient(self, x, pars, rows=False):
+        x = np.asarray(x, dtype=np.float64)
+        c, m, s, poly, ex, nb = self._split(pars, x.ndim - (np.ndim(pars)-1 if rows else 0))
+        u = (x[..., None]-m)/s
+        unit = np.exp(-u**2/2)/(_sqrt2pi*s)
+        gauss = c*unit
+        # d/dc, d/dm, d/ds interleaved as c0, m0, s0, c1, ...
+        d = np.stack([unit, gauss*u/s, gauss*(u*u-1)/s], axis=-1)
+        d = d.reshape(d.shape[:-2] + (-1,))
+        jac = [np.moveaxis(d, -1, nb)]
+        value = gauss.sum(axis=-1)
+        if self.degree >= 0:
+            powers = np.stack([x**j for j in range(self.degree+1)], axis=nb if rows else 0)
+            jac.append(np.broadcast_to(powers, value.shape[:nb] + (self.degree+1,) + value.shape[nb:]))
+            value = value + self._polynomial(x, poly)
+        if self.exponential:
+            e = np.exp(-x*ex[1])
+            jac.append(np.stack([np.broadcast_to(e, value.shape), -x*ex[0]*e], axis=nb))
+            value = value + ex[0]*e
+        return value, np.concatenate(jac, axis=nb)
+
+    # TFormula expression with parameters [0], [1], ... in the order of names
+    def formula(self):
+        terms = ["[{0}]/({1}*[{2}])*exp(-0.5*((x-[{3}])/[{2}])^2)".format(i, _sqrt2pi_literal, i+2, i+1)
+                 for i in range(0, 3*self.n_gauss, 3)]
+        k = 3*self.n_gauss
+        if self.degree >= 0:
+            poly = "[{:d}]".format(k+self.degree)
+            for j in range(self.degree-1, -1, -1):
+                poly = "[{:d}]+x*({:})".format(k+j, poly)
+            terms.append("({:})".format(poly))
+        if self.exponential:
+            terms.append("[{:d}]*exp(-x*[{:d}])".format(self.npar-2, self.npar-1))
+        return "+".join(terms)
+
+    # the parts for drawing: Gaussians batch + (n_gauss,) + x.shape, polynomial, exponential
+    def components(self, x, pars):
+        x = np.asarray(x, dtype=np.float64)
+        c, m, s, poly, ex, nb = self._split(pars, x.ndim)
+        gaussians = np.moveaxis(c/(_sqrt2pi*s)*np.exp(-(x[..., None]-m)**2/(2*s**2)), -1, nb)
+        zero = np.zeros(gaussians.shape[:nb] + x.shape)
+        polynomial = zero + self._polynomial(x, poly) if self.degree >= 0 else zero
+        exponential = zero + ex[0]*np.exp(-x*ex[1]) if self.exponential else zero
+        return gaussians, polynomial, exponential
+
+
+# number of fit parameters of a model, a PeakModel or a plain function f(x, *pars)
+def n_parameters(func):
+    npar = getattr(func, 'npar', None)
+    if npar is None:
+        npar = len(signature(func).parameters) - 1
+    return npar
+
+# TFormula expression of a model, None if there is no translation
+def formula(func):
+    if hasattr(func, 'formula'):
+        return func.formula()
+    return _formulas.get(getattr(func, '__name__', None))
+
+
+gauss_single = PeakModel(1)
+gauss_double = PeakModel(2)
+gauss_triple = PeakModel(3)
+gauss_quad = PeakModel(4)
+
+gauss_p0 = PeakModel(1, 0)
+gauss_plus_exp = PeakModel(1, exponential=True)
+gauss_p1 = PeakModel(1, 1)
+gauss_p2 = PeakModel(1, 2)
+gauss_triple_p1 = PeakModel(3, 1)
+gauss_quad_p0 = PeakModel(4, 0)
+gauss_quad_p1 = PeakModel(4, 1)
+gauss_quad_p2 = PeakModel(4, 2)
+
+def gauss_double_uncorr(x, N, r, m0, s0, m1, s1):
+    return N*(r/(np.sqrt(2*np.pi)*s0)*np.exp(-(x-m0)**2/(2*s0**2)) + (1-r)/(np.sqrt(2*np.pi)*s1)*np.exp(-(x-m1)**2/(2*s1**2)))
+
+# TFormula expressions of the models that are plain functions, by name
+_formulas = {'gauss_double_uncorr': "[0]*([1]/({0}*[3])*exp(-0.5*((x-[2])/[3])^2) + (1-[1])/({0}*[5])*exp(-0.5*((x-[4])/[5])^2))".format(_sqrt2pi_literal)}
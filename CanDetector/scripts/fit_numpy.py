@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NumPy fitting backend for the models in fit_models.
+
+The model and its analytic Jacobian (PeakModel.gradient) are evaluated on the whole array of
+bins at once and minimised with scipy's least-squares solver, so there is
+no Python callback per bin as with a ROOT.TF1 wrapping a Python function.
+The chi² follows ROOT's conventions (function at the bin centre, bins with
+their centre inside the range, empty bins skipped, errors sqrt(content)),
+so the numbers are comparable with fit_with_ROOT.
+
+    pars, errs, chi2, ndof, prob = fit_arrays(x, y, gauss_p1, [130, 262, 9.3, 28.7, -0.03], [240, 285])
+"""
+
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.stats import chi2 as chi2_distribution
+
+_sqrt2pi = np.sqrt(2*np.pi)
+
+
+# normalised Gaussian and its derivatives with respect to (c, m, s)
+def _gauss_terms(x, c, m, s):
+    e = np.exp(-(x-m)**2/(2*s**2))/(_sqrt2pi*s)
+    g = c*e
+    u = (x-m)/s
+    return g, [e, g*u/s, g*(u*u-1)/s]
+
+def _double_uncorr_terms(x, N, r, m0, s0, m1, s1):
+    g0, (e0, dm0, ds0) = _gauss_terms(x, N*r, m0, s0)
+    g1, (e1, dm1, ds1) = _gauss_terms(x, N*(1-r), m1, s1)
+    return g0+g1, [r*e0 + (1-r)*e1, N*(e0-e1), dm0, ds0, dm1, ds1]
+
+# analytic Jacobians of the models that are plain functions, by name
+_jacobians = {'gauss_double_uncorr': _double_uncorr_terms}
+
+# callable (x, pars) -> (value, jacobian) for func: a PeakModel brings its own
+# gradient, a known plain function is checked against its analytic Jacobian,
+# anything else is differentiated numerically
+def model_with_jacobian(func):
+    if hasattr(func, 'gradient'):
+        return func.gradient
+    terms = _jacobians.get(getattr(func, '__name__', None))
+    if terms is not None:
+        x_test = np.linspace(495., 505., 11)
+        p_test = [2.1, 0.3, 499., 1.5, 502., 2.5]
+        if not np.allclose(terms(x_test, *p_test)[0], func(x_test, *p_test), rtol=1e-9, atol=0):
+            terms = None
+
+    def value_and_jacobian(x, pars):
+        if terms is not None:
+            value, jac = terms(x, *pars)
+            return value, np.array(jac)
+        value = func(x, *pars)
+        jac = np.empty((len(pars), len(x)))
+        for i in range(len(pars)):
+            step = 1e-6*max(abs(pars[i]), 1e-3)
+            up, down = list(pars), list(pars)
+            up[i] += step
+            down[i] -= step
+            jac[i] = (func(x, *up) - func(x, *down))/(2*step)
+        return value, jac
+    return value_and_jacobian
+
+
+# which parameters are free, and their limits, following TH1::Fit:
+# lower >= upper (unless one of them is 0) fixes the parameter
+def _free_parameters(startval, bounds):
+    npar = len(startval)
+    free = np.ones(npar, dtype=bool)
+    lower = np.full(npar, -np.inf)
+    upper = np.full(npar, np.inf)
+    if bounds is not None:
+        for i in range(len(bounds[0])):
+            lo, hi = bounds[0][i], bounds[1][i]
+            if lo*hi != 0 and lo >= hi:
+                free[i] = False
+            elif lo < hi:
+                lower[i], upper[i] = lo, hi
+    return free, lower, upper
+
+# fit func to the bin contents y at bin centres x in the range xrange
+# chi² fit with errors sqrt(y) (yerr if given), or with likelihood=True a
+# binned Poisson likelihood fit whose chi2 is the Baker-Cousins likelihood ratio
+# returns (pars, errs, chi2, ndof, prob) like fit_and_draw_ROOT, prob in percent,
+# with return_cov also the covariance matrix (zero for fixed parameters)
+def fit_arrays(x, y, func, startval, xrange=None, bounds=None, likelihood=False, yerr=None, return_cov=False):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if xrange is None:
+        xrange = [x[0], x[-1]]
+    selected = (x >= xrange[0]) & (x <= xrange[1])
+    if likelihood:
+        selected &= y >= 0
+    else:
+        e = np.sqrt(np.clip(y, 0, None)) if yerr is None else np.asarray(yerr, dtype=np.float64)
+        selected &= e > 0
+        e = e[selected]
+    x, y = x[selected], y[selected]
+
+    model = model_with_jacobian(func)
+    pars = np.array(startval, dtype=np.float64)
+    free, lower, upper = _free_parameters(pars, bounds)
+    pars[free] = np.clip(pars[free], lower[free], upper[free])
+
+    def full(p):
+        q = pars.copy()
+        q[free] = p
+        return q
+
+    if likelihood:
+        def residuals(p):
+            f, _ = model(x, full(p))
+            f = np.clip(f, 1e-300, None)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                d = 2*(f - y + np.where(y > 0, y*np.log(y/f), 0.))
+            return np.sign(f-y)*np.sqrt(np.clip(d, 0, None))
+
+        def jacobian(p):
+            f, jac = model(x, full(p))
+            f = np.clip(f, 1e-300, None)
+            r = residuals(p)
+            # d r/d p = (1 - y/f)/r df/dp, tending to df/dp/sqrt(f) for f -> y
+            with np.errstate(divide='ignore', invalid='ignore'):
+                w = np.where(np.abs(r) > 1e-8, (1 - y/f)/r, 1/np.sqrt(f))
+            return (jac[free]*w).T
+    else:
+        def residuals(p):
+            return (model(x, full(p))[0] - y)/e
+
+        def jacobian(p):
+            return (model(x, full(p))[1][free]/e).T
+
+    result = least_squares(residuals, pars[free], jac=jacobian, bounds=(lower[free], upper[free]),
+                           method='trf', x_scale='jac')
+    pars = full(result.x)
+    chi2 = float(np.sum(result.fun**2))
+    ndof = int(len(x) - free.sum())
+
+    # parameter errors from the curvature at the minimum (UP = 1 for chi² and -2 ln L)
+    cov = np.zeros((len(pars), len(pars)))
+    jac = result.jac
+    try:
+        cov[np.ix_(free, free)] = np.linalg.inv(jac.T.dot(jac))
+    except np.linalg.LinAlgError:
+        cov[np.ix_(free, free)] = np.nan
+    errs = np.sqrt(np.diag(cov))
+    prob = float(chi2_distribution.sf(chi2, ndof))*100 if ndof > 0 else 0.
+    if return_cov:
+        return [float(v) for v in pars], [float(v) for v in errs], chi2, ndof, prob, cov
+    return [float(v) for v in pars], [float(v) for v in errs], chi2, ndof, prob
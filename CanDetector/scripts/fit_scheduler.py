@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run independent fits side by side, each worker process with its own ROOT.
+
+ROOT keeps global state (gDirectory, the lists of functions, the fitter),
+so fits can not be spread over threads. A FitScheduler takes fit jobs (bin
+contents, model, range, start values), ships them to a pool of worker
+processes and returns the results in the order the jobs were added,
+whatever order they finish in. A job can wait for others: its start values
+and bounds may then be functions of their results, as for the final
+gauss_quad_p2 fit of the Am spectrum seeded by the four single peaks.
+
+The workers fit with fit_and_draw_ROOT and so go through the fit cache; the
+same fit_and_draw_ROOT call afterwards (e.g. to draw the fit) reads the
+result back instead of fitting again.
+
+    fits = FitScheduler()
+    fits.add('am1', h_am, gauss_p1, [130, 262, 9.3, 28.7, -0.0325], [240, 285])
+    ...
+    fits.add('am', h_am, gauss_quad_p2, startval, [175, 450], bounds=bounds, after=['am1', 'am2', 'am3', 'am4'])
+    results = fits.run()    # {'am1': (pars, errs, chi2, ndof, prob, cov), ...}
+
+    ./fit_scheduler.py -j 4     # the HV scan, one job per run
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+class FitJob(object):
+    """
+    One fit: contents y of a histogram with equal bins, binning = (nbins, xmin, xmax),
+    and the arguments of fit_and_draw_ROOT. startval and bounds may be functions
+    of the results of the jobs named in after.
+    """
+    __slots__ = ('name', 'y', 'binning', 'func', 'startval', 'xrange', 'bounds', 'fitoptions', 'backend', 'use_cache', 'after')
+
+    def __init__(self, name, y, binning, func, startval, xrange, bounds=None, fitoptions="RS", backend="root", use_cache=True, after=()):
+        self.name = name
+        self.y = y
+        self.binning = binning
+        self.func = func
+        self.startval = startval
+        self.xrange = xrange
+        self.bounds = bounds
+        self.fitoptions = fitoptions
+        self.backend = backend
+        self.use_cache = use_cache
+        self.after = tuple(after)
+
+    # copy with startval and bounds evaluated for results, a dict name -> result
+    def resolved(self, results):
+        inputs = [results[name] for name in self.after]
+        job = FitJob.__new__(FitJob)
+        for k in FitJob.__slots__:
+            setattr(job, k, getattr(self, k))
+        if callable(self.startval):
+            job.startval = [float(v) for v in self.startval(*inputs)]
+        if callable(self.bounds):
+            job.bounds = self.bounds(*inputs)
+        return job
+
+
+# bin centres of equal bins, the same numbers as root_bridge.hist_arrays gives
+def bin_centres(binning):
+    nbins, xmin, xmax = binning
+    edges = np.linspace(xmin, xmax, nbins+1)
+    return (edges[:-1] + edges[1:])/2
+
+# contents and binning of a ROOT histogram, a Spectrum, or an array of bin
+# contents (by default one bin per channel starting at 0). Jobs carry the contents
+# only and are fitted with their Poisson errors (and cached by contents), so a
+# Spectrum whose variance is not its counts, e.g. after subtracting a background,
+# is refused rather than fitted with the wrong errors
+def hist_job_data(hist, binning=None):
+    if hasattr(hist, 'edges'):
+        if not hist.uniform or hist.counts.ndim != 1:
+            raise ValueError("fit jobs need single spectra with equal bins, not {:}".format(hist))
+        if not np.array_equal(hist.variance, hist.counts):
+            raise ValueError("fit jobs fit counts with Poisson errors, the variance of {:} is not its counts".format(hist))
+        return hist.counts, (hist.n_bins, float(hist.edges[0]), float(hist.edges[-1]))
+    if hasattr(hist, 'GetNbinsX'):
+        from root_bridge import hist_arrays
+        axis = hist.GetXaxis()
+        if axis.IsVariableBinSize():
+            raise ValueError("fit jobs need histograms with equal bins, {:} has not".format(hist.GetName()))
+        return hist_arrays(hist)[1], (hist.GetNbinsX(), axis.GetXmin(), axis.GetXmax())
+    y = np.asarray(hist, dtype=np.float64)
+    return y, tuple(binning) if binning is not None else (len(y), 0., float(len(y)))
+
+def _fit_numpy(job):
+    from fit_numpy import fit_arrays
+    from fit_cache import cached_fit, result_fields
+    x = bin_centres(job.binning)
+    startval = job.startval
+    if startval is None:
+        from gauss_seed import gauss_seed, seed_models
+        degree = [d for d, model in seed_models.items() if model == job.func]
+        if not degree:
+            raise ValueError("no closed-form start values for {:}, give startval".format(job.func))
+        startval = [float(v) for v in gauss_seed(job.y, job.xrange, x, degree[0])[0]]
+    def fit(startval):
+        return fit_arrays(x, job.y, job.func, startval, job.xrange, job.bounds, likelihood='L' in job.fitoptions, return_cov=True)
+    if not job.use_cache:
+        return fit(startval)
+    # the options string of fit_and_draw_ROOT(..., backend="numpy"), so both share the cache
+    record = cached_fit(fit, x, job.y, job.func, startval, job.xrange, job.bounds, "numpy:"+job.fitoptions)
+    return [record[k] for k in result_fields]
+
+def _fit_root(job):
+    from fit_spectra_common import fit_and_draw_ROOT, hist_pool
+    from root_bridge import fill_hist
+    hist = hist_pool.acquire(*job.binning)
+    try:
+        fill_hist(hist, job.y)
+        return fit_and_draw_ROOT(hist, job.func, job.startval, None, job.xrange, bounds=job.bounds, fitoptions=job.fitoptions,
+                                 return_pcov=True, backend="root", use_cache=job.use_cache)
+    finally:
+        hist_pool.release(hist)
+
+# fit of one job whose startval and bounds are resolved, in whichever process calls it
+# returns (pars, errs, chi2, ndof, prob, cov) like fit_and_draw_ROOT(..., return_pcov=True)
+def run_job(job):
+    pars, errs, chi2, ndof, prob, cov = _fit_numpy(job) if job.backend == "numpy" else _fit_root(job)
+    return [float(v) for v in pars], [float(v) for v in errs], float(chi2), int(ndof), float(prob), np.array(cov, dtype=np.float64)
+
+# the workers are forked: with spawn every worker would first run the calling
+# script again, and the analysis scripts have no __main__ guard. A forked worker
+# has its own copy of ROOT from then on.
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+
+
+class FitScheduler(object):
+    """
+    Fit jobs by name, run by a pool of `processes` worker processes (all cores
+    by default, 1 fits in this process). A job is started once the jobs it
+    waits for are done.
+    """
+    __slots__ = ('jobs', 'processes', 'backend', 'use_cache')
+
+    def __init__(self, processes=None, backend="root", use_cache=True):
+        self.jobs = OrderedDict()
+        self.processes = processes or os.cpu_count() or 1
+        self.backend = backend
+        self.use_cache = use_cache
+
+    # add a fit of hist (a ROOT histogram, a Spectrum or an array of bin contents with binning)
+    # with the arguments of fit_and_draw_ROOT; startval and bounds can be functions
+    # taking the results of the jobs named in after, which have to be added before
+    def add(self, name, hist, func, startval, xrange, bounds=None, fitoptions="RS", after=(), binning=None):
+        if name in self.jobs:
+            raise ValueError("there is a fit named {:} already".format(name))
+        missing = [a for a in after if a not in self.jobs]
+        if missing:
+            raise ValueError("{:} waits for {:}, which have to be added first".format(name, ", ".join(missing)))
+        y, binning = hist_job_data(hist, binning)
+        self.jobs[name] = FitJob(name, y, binning, func, startval, xrange, bounds, fitoptions, self.backend, self.use_cache, after)
+        return name
+
+    # fit all jobs, returns name -> (pars, errs, chi2, ndof, prob, cov) in the order
+    # the jobs were added
+    def run(self):
+        results = {}
+        if self.processes <= 1 or len(self.jobs) <= 1:
+            for name, job in self.jobs.items():
+                results[name] = run_job(job.resolved(results))
+        else:
+            waiting = OrderedDict(self.jobs)
+            running = {}
+            with ProcessPoolExecutor(min(self.processes, len(self.jobs)), mp_context=_context()) as pool:
+                while waiting or running:
+                    for name in [n for n, job in waiting.items() if all(a in results for a in job.after)]:
+                        running[pool.submit(run_job, waiting.pop(name).resolved(results))] = name
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        try:
+                            results[name] = future.result()
+                        except Exception as e:
+                            raise RuntimeError("fit {:} failed: {:}".format(name, e)) from e
+        return OrderedDict((name, results[name]) for name in self.jobs)
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Fit the ROI of every HV-scan run with a pool of worker processes")
+    parser.add_argument('--data', default="../data/mca")
+    parser.add_argument('--source', nargs='+', default=['fe', 'am'])
+    parser.add_argument('-j', '--processes', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--backend', default="root", choices=["root", "numpy"])
+    parser.add_argument('--no-cache', action='store_true', help='always fit, do not use the fit cache')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArguments(argv)
+    from mca_runs import RunCatalog
+    from gauss_seed import gauss_seed
+    from fit_batch import roi_ranges
+    from fit_models import gauss_single
+    catalog = RunCatalog.from_directories([args.data])
+    counts, runs = catalog.load(np.concatenate([catalog.select_index(source=source, kind='scan') for source in args.source]))
+    y = counts.astype(np.float64)
+    xrange = roi_ranges(runs, y.shape[1])
+    start = gauss_seed(y, xrange)
+
+    fits = FitScheduler(args.processes, args.backend, not args.no_cache)
+    for i, run in enumerate(runs):
+        fits.add(run['filename'], y[i], gauss_single, list(start[i]), list(xrange[i]), fitoptions="LRS")
+    t0 = time.time()
+    results = fits.run()
+    elapsed = time.time() - t0
+    for name, (pars, errs, chi2, ndof, prob, cov) in results.items():
+        print("{:24s} mean {:8.2f} ± {:5.2f}  sigma {:6.2f}  chi2/ndof {:7.1f}/{:3d}".format(name, pars[1], errs[1], abs(pars[2]), chi2, ndof))
+    print("{:d} fits in {:.2f} s with {:d} processes".format(len(results), elapsed, min(fits.processes, len(results))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -13,7 +13,7 @@ from common import show_title, show_text
 import matplotlib.pyplot as plt
 np.random.seed(42)
 import ROOT
-from array import array
+from root_bridge import graph_errors
 from fit_spectra_common import get_draw_spline, subtract_bkg, fit_and_draw_ROOT, energywithuncertainty, energyall, \
                                gauss_single, gauss_double_uncorr, gauss_p1, \
                                fe_escape_energy, fe_main_energy, fe_sec_energy, am_main_energy, \
@@ -147,7 +147,7 @@ y = [ fe_escape_energy, fe_main_energy, fe_sec_energy, am_main_energy ]
 x = [ fe_esc_mean, fe_mean, fe_sec_mean, am_mean ]
 yerr = [ fe_escape_energy_unc, fe_main_energy_unc, fe_sec_energy_unc, am_main_energy_unc ]
 xerr = np.array([ fe_esc_unc, fe_unc, fe_sec_unc, am_unc ])
-gr = ROOT.TGraphErrors( len(x), array('d',x), array('d',y), array('d',xerr), array('d',yerr) )
+gr = graph_errors(x, y, xerr, yerr)
 fit1 = ROOT.TF1("fit1","pol1", min(x), max(x));
 fit1.SetParameters(-0.2232671292611002, 0.06796181642128599)
 res = gr.Fit(fit1, "RS")
@@ -13,8 +13,9 @@ from common import show_title, show_text
 import matplotlib.pyplot as plt
 np.random.seed(42)
 import ROOT
-from array import array
-from fit_spectra_common import get_draw_spline, subtract_bkg, fit_and_draw_ROOT, energywithuncertainty, energyall, \
+from root_bridge import graph_errors
+from fit_scheduler import FitScheduler
+from fit_spectra_common import get_draw_spline, subtract_bkg, subtract_continuum, fit_and_draw_ROOT, energywithuncertainty, energyall, \
                                gauss_single, gauss_double_uncorr, gauss_p1, gauss_quad_p2, \
                                fe_escape_energy, fe_main_energy, fe_sec_energy, am_main_energy, \
                                fe_escape_energy_unc, fe_main_energy_unc, fe_sec_energy_unc, am_main_energy_unc
@@ -36,8 +37,11 @@ axins = zoomed_inset_axes(ax, 5.0, loc=5)
 
 # Get histograms and make+draw splines (normalizing to fe)
 [h_fe,  spline_fe, time_fe]  = get_draw_spline("../data/mca/fe_4_1937_spectrum.mca",  0.02,  'b', 'b', "Fe-55",      ax, axins, False)
-[h_am,  spline_am, _]  = get_draw_spline("../data/mca/am_4_1937_spectrum.mca",  0.02,  'r', 'r', "Am-241",     ax, axins, True, time_fe)
+[h_am,  spline_am, time_am]  = get_draw_spline("../data/mca/am_4_1937_spectrum.mca",  0.02,  'r', 'r', "Am-241",     ax, axins, True, time_fe)
 [h_bkg, spline_bkg, _] = get_draw_spline("../data/mca/bkg_4_1937_spectrum.mca", 0.002, 'g', 'g', "Background", ax, axins, True, time_fe)
+# or the same background spline from the stored template, built once for all runs
+#from background_templates import BackgroundTemplates
+#spline_bkg = BackgroundTemplates(clock='status_real_time', reference_time=time_fe).get('can', 4, 1937).function(time_fe)
 
 # Get histograms and make+draw splines (normalizing to 1)
 #[h_fe,  spline_fe, time_fe]  = get_draw_spline("../data/mca/fe_4_1937_spectrum.mca",  0.02,  'b', 'b', "Fe-55",      ax, axins)
@@ -47,6 +51,9 @@ axins = zoomed_inset_axes(ax, 5.0, loc=5)
 # subtract backround and draw
 h_fe_new = subtract_bkg( h_fe, spline_fe, spline_bkg, "b", ax, axins )
 h_am_new = subtract_bkg( h_am, spline_am, spline_bkg, "r", ax, axins )
+# or without the background run, each spectrum minus its own continuum (SNIP)
+#h_fe_new = subtract_continuum( h_fe, 1., 24, "b", ax, axins )
+#h_am_new = subtract_continuum( h_am, time_fe/time_am, 24, "r", ax, axins )
 
 # finished zoomed in sub-figure
 axins.set_xlim(0, 149)
@@ -72,6 +79,49 @@ binwidth = h_am_new.GetBinWidth(1)
 
 
 
+#%%#####################################
+# Run all fits side by side
+######################################
+
+# the peak fits are independent, only the final Am fit starts from the four
+# single Am peaks; they all run in worker processes here and the calls to
+# fit_and_draw_ROOT below read the results back from the fit cache
+
+lower_bound=0.8
+upper_bound=1.2
+
+# start values and bounds of the final Am fit from the fits of the single peaks
+def am_final_startval(am1, am2, am3, am4):
+    return list(am1[0][:3]) + list(am2[0][:3]) + list(am3[0][:3]) + list(am4[0][:3]) + [20, -0.001, 0]
+
+def am_final_bounds(am1, am2, am3, am4):
+    [am1_c, am1_mean, am1_sigma], [am2_c, am2_mean, am2_sigma], [am3_c, am3_mean, am3_sigma], [am4_c, am4_mean, am4_sigma] = \
+        [am[0][:3] for am in (am1, am2, am3, am4)]
+    return ( [ 60,                am1_mean*lower_bound, am1_sigma*lower_bound*2, \
+               am2_c*lower_bound, am2_mean*lower_bound, am2_sigma*lower_bound, \
+               am3_c*lower_bound, am3_mean*lower_bound, am3_sigma*lower_bound, \
+               am4_c*lower_bound, am4_mean*lower_bound, am4_sigma*lower_bound, \
+               0.0, -1.0, 0.000000001 ],
+             [ 1000,              am1_mean*upper_bound, am1_sigma*upper_bound, \
+               am2_c*upper_bound*100, am2_mean*upper_bound, am2_sigma*upper_bound*0.5, \
+               am3_c*upper_bound, am3_mean*upper_bound, am3_sigma*upper_bound, \
+               am4_c*upper_bound, am4_mean*upper_bound, am4_sigma*upper_bound, \
+               100, -0.001, 0.000000001 ]
+           )
+
+fits = FitScheduler()
+fits.add('fe_esc', h_fe_new, gauss_single, [48, 46.4, 5.9], [37,50])
+fits.add('fe', h_fe_new, gauss_double_uncorr, [800, 0.88, 90.2, 7.04, 99.1, 4.04], [70,120])
+fits.add('am', h_am_new, gauss_single, [5116, 882, 22], [865, 920])
+fits.add('am1', h_am_new, gauss_p1, [130, 262, 9.3, 28.7, -0.0325], [240,285])
+fits.add('am2', h_am_new, gauss_p1, [47.5, 317.77, 5.92, 20.6, 0.00479], [300,335])
+fits.add('am3', h_am_new, gauss_p1, [904, 394, 14.56, 87, -0.183], [360,415])
+fits.add('am4', h_am_new, gauss_p1, [4190, 180.97, 14.92, 87, -0.2], [175,216], bounds=([1000,170,5,0,-0.3],[10_000,190,20,200,1]))
+fits.add('am_final', h_am_new, gauss_quad_p2, am_final_startval, [175,450], bounds=am_final_bounds, after=['am1', 'am2', 'am3', 'am4'])
+fit_results = fits.run()
+
+
+
 #%%#####################################
 # Fit spectra 
 ######################################
@@ -157,7 +207,7 @@ y = [ fe_escape_energy, fe_main_energy, fe_sec_energy, am_main_energy ]
 x = [ fe_esc_mean, fe_mean, fe_sec_mean, am_mean ]
 yerr = [ fe_escape_energy_unc, fe_main_energy_unc, fe_sec_energy_unc, am_main_energy_unc ]
 xerr = np.array([ fe_esc_unc, fe_unc, fe_sec_unc, am_unc ])
-gr = ROOT.TGraphErrors( len(x), array('d',x), array('d',y), array('d',xerr), array('d',yerr) )
+gr = graph_errors(x, y, xerr, yerr)
 fit1 = ROOT.TF1("fit1","pol1", min(x), max(x));
 fit1.SetParameters(0.0740639, 0.0674355)
 res = gr.Fit(fit1, "RS")
@@ -208,12 +258,11 @@ am4_chi4, am4_ndof, am4_prob = fit_and_draw_ROOT(h_am_new, gauss_p1, [4190, 180.
                                                  col='g-', bounds=([1000,170,5,0,-0.3],[10_000,190,20,200,1])
                                                  )
 
-lower_bound=0.8
-upper_bound=1.2
-
 p0=20
 p1=-0.001
 
+am_singles = [fit_results[name] for name in ('am1', 'am2', 'am3', 'am4')]
+
 [ am1_c, am1_mean, am1_sigma, am2_c, am2_mean, am2_sigma, \
   am3_c, am3_mean, am3_sigma, am4_c, am4_mean, am4_sigma, \
   am_final_p0, am_final_p1, am_final_p2 ], \
@@ -223,24 +272,10 @@ p1=-0.001
   am4_c_unc, am4_mean_unc, am4_sigma_unc, \
   am_final_p0_unc, am_final_p1_unc, am_final_p2_unc ], \
 am_final_chi4, am_final_ndof, am_final_prob = \
-    fit_and_draw_ROOT( h_am_new, gauss_quad_p2, \
-                       [ am1_c, am1_mean, am1_sigma, am2_c, am2_mean, am2_sigma, \
-                         am3_c, am3_mean, am3_sigma, am4_c, am4_mean, am4_sigma, \
-                         20, -0.001, 0
-                         ], \
+    fit_and_draw_ROOT( h_am_new, gauss_quad_p2, am_final_startval(*am_singles), \
                        ax, [175,450], True, \
                        draw_individually=True, \
-                       bounds=( [ 60,                am1_mean*lower_bound, am1_sigma*lower_bound*2, \
-                                  am2_c*lower_bound, am2_mean*lower_bound, am2_sigma*lower_bound, \
-                                  am3_c*lower_bound, am3_mean*lower_bound, am3_sigma*lower_bound, \
-                                  am4_c*lower_bound, am4_mean*lower_bound, am4_sigma*lower_bound, \
-                                  0.0, -1.0, 0.000000001 ],
-                                [ 1000,              am1_mean*upper_bound, am1_sigma*upper_bound, \
-                                  am2_c*upper_bound*100, am2_mean*upper_bound, am2_sigma*upper_bound*0.5, \
-                                  am3_c*upper_bound, am3_mean*upper_bound, am3_sigma*upper_bound, \
-                                  am4_c*upper_bound, am4_mean*upper_bound, am4_sigma*upper_bound, \
-                                  100, -0.001, 0.000000001 ]
-                               )
+                       bounds=am_final_bounds(*am_singles)
                       )
 
 # we fit with a gauss on top of a flat background
@@ -7,8 +7,10 @@ Created on Wed Oct  31 08:19:00 2018
 """
 
 import numpy as np
-import scipy.interpolate as interpolate
 from common import mca_to_hist
+from root_bridge import hist_contents
+from bkg_subtraction import channel_centres, smoothing_spline
+from snip import snip_background
 import rootpy.plotting.root2matplotlib as rplt
 np.random.seed(42)
 #from scipy.optimize import curve_fit
@@ -21,8 +23,8 @@ from inspect import signature
 # Show data with bkg subtracted 
 ######################################
 
-def get_draw_spline( fname, smoothing_strength=0.002, color_hist='k', color_spline='y', label="unlabeled", ax=None, axins=None, do_norm=True, time_to_norm_to=None ) :
-    (hist, r_min, r_max, time_hist) = mca_to_hist(fname, False)
+def get_draw_spline( fname, smoothing_strength=0.002, color_hist='k', color_spline='y', label="unlabeled", ax=None, axins=None, do_norm=True, time_to_norm_to=None, use_cache=True ) :
+    (hist, r_min, r_max, time_hist) = mca_to_hist(fname, False, use_cache)
     if do_norm:
         if time_to_norm_to is None:
             hist.Scale(1/time_hist)
@@ -31,11 +33,12 @@ def get_draw_spline( fname, smoothing_strength=0.002, color_hist='k', color_spli
 #    hist.Rebin(4)
 #    rplt.hist(hist, stacked=False, fill=False, axes=ax)
 #    print(time_hist)
-    x = [hist.GetBinCenter(x) for x in range(0,hist.GetNbinsX())]
-    y = [hist.GetBinContent(x) for x in range(0,len(x))]
-    t, c, k = interpolate.splrep(x, y, s=smoothing_strength, k=3)
+    # bins 0..n-1, the underflow bin and all but the last channel
+    n = hist.GetNbinsX()
+    x = channel_centres(n, hist.GetXaxis().GetXmin(), hist.GetXaxis().GetXmax())[:-1]
+    y = hist_contents(hist)[:n]
+    spline = smoothing_spline(x, y, smoothing_strength)
     xx = np.linspace(x[0], x[-1], 200)
-    spline = interpolate.BSpline(t, c, k, extrapolate=False)
     ax.plot(xx, spline(xx), color_spline, label=label,zorder=10, linestyle="--")
     if axins is not None:
         axins.plot(xx, spline(xx), color_spline, label=label,zorder=10, linestyle="--")
@@ -43,11 +46,29 @@ def get_draw_spline( fname, smoothing_strength=0.002, color_hist='k', color_spli
 #    plt.grid()
     return [hist,spline,time_hist]
 
+# both splines on bins 0..n-1 in one call each, the last bin keeps its contents
+# (bkg_subtraction.subtract_background does the same on arrays, with errors)
 def subtract_bkg( h_sig, sp_sig, sp_bkg, color='k', ax=None, axins=None ) :
-    x = [ h_sig.GetBinCenter(x) for x in range(1, h_sig.GetNbinsX()) ]
+    n = h_sig.GetNbinsX()
+    x = channel_centres(n, h_sig.GetXaxis().GetXmin(), h_sig.GetXaxis().GetXmax())[:-1]
     h_new = h_sig.Clone()
-    for x in range( 0, h_sig.GetNbinsX() ) :
-        h_new.SetBinContent( x, max(0,sp_sig(h_sig.GetBinCenter(x)) - sp_bkg(h_sig.GetBinCenter(x))) )
+    contents = hist_contents(h_new)
+    contents[:n] = np.fmax(sp_sig(x) - sp_bkg(x), 0.)
+    h_new.SetContent(contents)
+    rplt.hist(h_new, color=color, axes=ax)
+    if axins is not None:
+        rplt.hist(h_new, color=color, axes=axins)
+    return h_new
+
+# instead of subtract_bkg, without a background run: the SNIP continuum of h_sig
+# itself is subtracted from channels 1..n, on the counts (h_sig divided by the
+# scale get_draw_spline applied to it)
+def subtract_continuum( h_sig, scale=1., iterations=24, color='k', ax=None, axins=None ) :
+    h_new = h_sig.Clone()
+    contents = hist_contents(h_new)
+    counts = contents[1:-1]/scale
+    contents[1:-1] = np.fmax(counts - snip_background(counts, iterations), 0.)*scale
+    h_new.SetContent(contents)
     rplt.hist(h_new, color=color, axes=ax)
     if axins is not None:
         rplt.hist(h_new, color=color, axes=axins)
@@ -59,47 +80,14 @@ def subtract_bkg( h_sig, sp_sig, sp_bkg, color='k', ax=None, axins=None ) :
 # Fit spectra 
 ######################################
 
-def gauss_single(x, c0, m0, s0):
-    return c0/(np.sqrt(2*np.pi)*s0)*np.exp(-(x-m0)**2/(2*s0**2))
-def gauss_double(x, c0, m0, s0, c1, m1, s1):
-    return c0/(np.sqrt(2*np.pi)*s0)*np.exp(-(x-m0)**2/(2*s0**2)) + \
-           c1/(np.sqrt(2*np.pi)*s1)*np.exp(-(x-m1)**2/(2*s1**2))
-def gauss_triple(x, c0, m0, s0, c1, m1, s1, c2, m2, s2):
-    return c0/(np.sqrt(2*np.pi)*s0)*np.exp(-(x-m0)**2/(2*s0**2)) + \
-           c1/(np.sqrt(2*np.pi)*s1)*np.exp(-(x-m1)**2/(2*s1**2)) + \
-           c2/(np.sqrt(2*np.pi)*s2)*np.exp(-(x-m2)**2/(2*s2**2))
-def gauss_quad(x, c0, m0, s0, c1, m1, s1, c2, m2, s2, c3, m3, s3):
-    return c0/(np.sqrt(2*np.pi)*s0)*np.exp(-(x-m0)**2/(2*s0**2)) + \
-           c1/(np.sqrt(2*np.pi)*s1)*np.exp(-(x-m1)**2/(2*s1**2)) + \
-           c2/(np.sqrt(2*np.pi)*s2)*np.exp(-(x-m2)**2/(2*s2**2)) + \
-           c3/(np.sqrt(2*np.pi)*s3)*np.exp(-(x-m3)**2/(2*s3**2))
-
-def gauss_p0(x, c0, m0, s0, p0):
-    return gauss_single(x, c0, m0, s0) + p0
-
-def gauss_plus_exp(x, c0, m0, s0, p0, t0):
-    return gauss_single(x, c0, m0, s0) + p0*np.exp(-x*t0)
-
-def gauss_p1(x, c0, m0, s0, p0, p1):
-    return gauss_single(x, c0, m0, s0) + p0 + p1*x
-
-def gauss_p2(x, c0, m0, s0, p0, p1, p2):
-    return gauss_single(x, c0, m0, s0) + p0 + p1*x + p2*x**2
-
-def gauss_triple_p1(x, c0, m0, s0, c1, m1, s1, c2, m2, s2, p0, p1):
-    return gauss_triple(x, c0, m0, s0, c1, m1, s1, c2, m2, s2) + p0 + p1*x
-
-def gauss_quad_p0(x, c0, m0, s0, c1, m1, s1, c2, m2, s2, c3, m3, s3, p0):
-    return gauss_quad(x, c0, m0, s0, c1, m1, s1, c2, m2, s2, c3, m3, s3) + p0
-
-def gauss_quad_p1(x, c0, m0, s0, c1, m1, s1, c2, m2, s2, c3, m3, s3, p0, p1):
-    return gauss_quad(x, c0, m0, s0, c1, m1, s1, c2, m2, s2, c3, m3, s3) + p0 + p1*x
-
-def gauss_quad_p2(x, c0, m0, s0, c1, m1, s1, c2, m2, s2, c3, m3, s3, p0, p1, p2):
-    return gauss_quad(x, c0, m0, s0, c1, m1, s1, c2, m2, s2, c3, m3, s3) + p0 + p1*x + p2*x**2
-
-def gauss_double_uncorr(x, N, r, m0, s0, m1, s1):
-    return N*(r/(np.sqrt(2*np.pi)*s0)*np.exp(-(x-m0)**2/(2*s0**2)) + (1-r)/(np.sqrt(2*np.pi)*s1)*np.exp(-(x-m1)**2/(2*s1**2)))
+# the fit models live in fit_models, which works without ROOT
+from fit_models import PeakModel, n_parameters, formula, gauss_single, gauss_double, gauss_triple, gauss_quad, gauss_p0, gauss_plus_exp, \
+                       gauss_p1, gauss_p2, gauss_triple_p1, gauss_quad_p0, gauss_quad_p1, gauss_quad_p2, \
+                       gauss_double_uncorr
+from fit_numpy import fit_arrays
+from root_bridge import HistPool, FunctionPool, hist_contents, hist_arrays, fill_hist
+from gauss_seed import gauss_seed, seed_models
+from fit_cache import FitCache, cached_fit, result_fields
 
 # energy of peaks in keV
 #fe_escape_energy = 2.96 # 60/76*2.958+16/76*2.956
@@ -119,47 +107,123 @@ am_main_energy_unc = 0.0001
 # Fitting with ROOT (FINALLY WORKS!) 
 ######################################
 
-fitWithROOT_counter = 0
-def fit_with_ROOT(hist_orig, fitobject, fitoptions="RS"):
-    global fitWithROOT_counter
-    fitWithROOT_counter += 1
-    hist = ROOT.TH1D("h"+str(fitWithROOT_counter), "h"+str(fitWithROOT_counter), hist_orig.GetNbinsX(), hist_orig.GetXaxis().GetXmin(), hist_orig.GetXaxis().GetXmax() )
-    for i in range(1,hist_orig.GetNbinsX()+1):
-        hist.SetBinContent(i,hist_orig.GetBinContent(i))
-        hist.SetBinError(i,np.sqrt(hist_orig.GetBinContent(i)))
-    hist.Fit(fitobject, fitoptions)
-    return fitobject.GetChisquare(), fitobject.GetNDF(), fitobject.GetProb()*100
+# fits go through pooled histograms and functions, no new TH1D/TF1 per fit
+hist_pool = HistPool()
+function_pool = FunctionPool()
+fit_cache = FitCache()
+
+# with return_cov also the covariance matrix, from the fit result if fitoptions
+# contain "S", otherwise only its diagonal from the parameter errors
+def fit_with_ROOT(hist_orig, fitobject, fitoptions="RS", return_cov=False):
+    hist = hist_pool.acquire(hist_orig.GetNbinsX(), hist_orig.GetXaxis().GetXmin(), hist_orig.GetXaxis().GetXmax())
+    contents = hist_contents(hist_orig)[1:-1]
+    with np.errstate(invalid='ignore'):
+        fill_hist(hist, contents, np.sqrt(contents))
+    result = hist.Fit(fitobject, fitoptions)
+    hist_pool.release(hist)
+    if not return_cov:
+        return fitobject.GetChisquare(), fitobject.GetNDF(), fitobject.GetProb()*100
+    npar = fitobject.GetNpar()
+    try:
+        m = result.GetCovarianceMatrix()
+        cov = np.array([[m(i, j) for j in range(npar)] for i in range(npar)])
+    except (AttributeError, ReferenceError, TypeError):
+        cov = np.diag([fitobject.GetParError(i)**2 for i in range(npar)])
+    return fitobject.GetChisquare(), fitobject.GetNDF(), fitobject.GetProb()*100, cov
+
+# python models with a TFormula translation (fit_models.formula) are compiled by
+# cling instead of calling back into python for every bin; the first time a
+# model is fitted its formula is compared with the python function at the start
+# values, and if they disagree the fit falls back to the python callback
+use_formula = True
+formula_checked = {}
+
+def formula_matches(fitobject, func, startval, xmin, xmax):
+    x = np.linspace(xmin, xmax, 101)
+    expected = func(x, *startval)
+    for i, val in enumerate(startval):
+        fitobject.SetParameter(i, val)
+    compiled = np.array([fitobject.Eval(v) for v in x])
+    return np.allclose(compiled, expected, rtol=1e-9, atol=1e-12*np.max(np.abs(expected)))
 
 makeFitObject_counter = 0
-def make_fit_object(funcOrExpr, xmin, xmax):
-    global makeFitObject_counter
-    makeFitObject_counter += 1
-    if callable(funcOrExpr) :
-        f = lambda x, pars : funcOrExpr(x[0], *pars)
-        return ROOT.TF1("fit"+str(makeFitObject_counter), f, xmin, xmax, len(signature(funcOrExpr).parameters)-1)
-    else:
-        return ROOT.TF1("fit"+str(makeFitObject_counter), funcOrExpr, xmin, xmax, 4)
-
-def fit_and_draw_ROOT(hist, func, startval, ax, xrange=None, dont_plot_hist=False, ax2=None, return_pcov=False, draw_individually=False, bounds=None, col='b-', dont_draw_fit=False, fitoptions="RS", label=None):
+def make_fit_object(funcOrExpr, xmin, xmax, startval=None):
+    def make(expr=None):
+        global makeFitObject_counter
+        makeFitObject_counter += 1
+        if expr is not None:
+            f = ROOT.TF1("fit"+str(makeFitObject_counter), expr, xmin, xmax)
+            for i, name in enumerate(getattr(funcOrExpr, 'names', ())):
+                f.SetParName(i, name)
+            return f
+        if callable(funcOrExpr) :
+            f = lambda x, pars : funcOrExpr(x[0], *pars)
+            return ROOT.TF1("fit"+str(makeFitObject_counter), f, xmin, xmax, n_parameters(funcOrExpr))
+        else:
+            return ROOT.TF1("fit"+str(makeFitObject_counter), funcOrExpr, xmin, xmax, 4)
+    if not callable(funcOrExpr):
+        return function_pool.get(funcOrExpr, make, xmin, xmax, 4)
+    npar = n_parameters(funcOrExpr)
+    expr = formula(funcOrExpr) if use_formula else None
+    if expr is not None and formula_checked.get(funcOrExpr, True):
+        f = function_pool.get((funcOrExpr, expr), lambda: make(expr), xmin, xmax, npar)
+        if funcOrExpr not in formula_checked and startval is not None:
+            formula_checked[funcOrExpr] = f.GetNpar() == npar and formula_matches(f, funcOrExpr, startval, xmin, xmax)
+            if not formula_checked[funcOrExpr]:
+                print("WARNING: the formula of {:} does not match the python function, fitting with the python callback".format(funcOrExpr))
+        if formula_checked.get(funcOrExpr, True):
+            return f
+    return function_pool.get(funcOrExpr, make, xmin, xmax, npar)
+
+# closed-form start values (gauss_seed) of gauss_single, gauss_p0 or gauss_p1 in xrange
+def seed_startval(hist, func, xrange):
+    degree = [d for d, model in seed_models.items() if model == func]
+    if not degree:
+        raise ValueError("no closed-form start values for {:}, give startval".format(func))
+    x, y = hist_arrays(hist)
+    return [float(v) for v in gauss_seed(y, xrange, x, degree[0])[0]]
+
+# backend="numpy" fits with fit_numpy instead of Minuit: same chi² definition,
+# an "L" in fitoptions selects the Poisson likelihood fit
+# startval=None takes the start values from seed_startval
+# results are kept in fit_cache (use_cache=False to always fit), with return_pcov
+# the covariance matrix is returned as well
+def fit_and_draw_ROOT(hist, func, startval, ax, xrange=None, dont_plot_hist=False, ax2=None, return_pcov=False, draw_individually=False, bounds=None, col='b-', dont_draw_fit=False, fitoptions="RS", label=None, backend="root", use_cache=True):
     if xrange is None:
-        xrange = [0, 1024]
-    fitobject = make_fit_object(func, xrange[0], xrange[1])
-    if len(startval) < 10:
-        fitobject.SetParameters(*startval)
-    else:
-        for i, val in enumerate(startval):
-            fitobject.SetParameter(i, val)
-    if bounds is not None:
-        for i in range(0, len(bounds[0])):
-            fitobject.SetParLimits(i, bounds[0][i], bounds[1][i])
-    chi2, ndof, prob = fit_with_ROOT(hist, fitobject, fitoptions)
-    if callable(func) :
-        funcrange = range(0,len(signature(func).parameters)-1)
+        xrange = [hist.GetXaxis().GetXmin(), hist.GetXaxis().GetXmax()]
+    if startval is None:
+        startval = seed_startval(hist, func, xrange)
+    x, y = hist_arrays(hist)
+
+    def run_fit(startval):
+        if backend == "numpy":
+            if not callable(func):
+                raise ValueError("the numpy backend needs a python function, not {:}".format(func))
+            return fit_arrays(x, y, func, startval, xrange, bounds, likelihood='L' in fitoptions, return_cov=True)
+        fitobject = make_fit_object(func, xrange[0], xrange[1], startval)
+        if len(startval) < 10:
+            fitobject.SetParameters(*startval)
+        else:
+            for i, val in enumerate(startval):
+                fitobject.SetParameter(i, val)
+        if bounds is not None:
+            for i in range(0, len(bounds[0])):
+                fitobject.SetParLimits(i, bounds[0][i], bounds[1][i])
+        chi2, ndof, prob, cov = fit_with_ROOT(hist, fitobject, fitoptions, return_cov=True)
+        if callable(func) :
+            funcrange = range(0,n_parameters(func))
+        else:
+            funcrange = range(4)
+        pars = [fitobject.GetParameter(i) for i in funcrange]
+        errs = [fitobject.GetParError(i) for i in funcrange]
+        return pars, errs, chi2, ndof, prob, cov[:len(pars), :len(pars)]
+
+    if use_cache:
+        result = cached_fit(run_fit, x, y, func, startval, xrange, bounds, backend+":"+fitoptions, fit_cache)
+        pars, errs, chi2, ndof, prob, cov = [result[k] for k in result_fields]
     else:
-        funcrange = range(4)
-    pars = [fitobject.GetParameter(i) for i in funcrange]
-    errs = [fitobject.GetParError(i) for i in funcrange]
-    
+        pars, errs, chi2, ndof, prob, cov = run_fit(startval)
+
     x = np.linspace(xrange[0], xrange[1], 1000)
     if not dont_plot_hist:
         if ax is not None:
@@ -173,7 +237,14 @@ def fit_and_draw_ROOT(hist, func, startval, ax, xrange=None, dont_plot_hist=Fals
         if ax2 is not None:
             ax2.plot(x,func(x, *pars), col, zorder=10)
     if draw_individually:
-        if func.__name__ == "gauss_double_uncorr":
+        cols=['m:','g:','b:','k:']
+        if hasattr(func, 'components'):
+            gaussians, polynomial, _ = func.components(x, pars)
+            for i, g in enumerate(gaussians):
+                ax.plot(x, g, cols[i%len(cols)])
+            if func.degree > 0:
+                ax.plot(x, polynomial, 'g--')
+        elif func.__name__ == "gauss_double_uncorr":
             ax.plot(x, gauss_single(x, pars[0]*pars[1], pars[2], pars[3]), 'r--')
             ax.plot(x, gauss_single(x, pars[0]*(1-pars[1]), pars[4], pars[5]), 'g--')
         else:
@@ -186,7 +257,6 @@ def fit_and_draw_ROOT(hist, func, startval, ax, xrange=None, dont_plot_hist=Fals
                 else:
                     break
             n*=3
-            cols=['m:','g:','b:','k:']
             for i in range(0,n,3):
                 ax.plot(x, gauss_single(x, pars[i], pars[i+1], pars[i+2]), cols[i//3])
             n = -1
@@ -200,6 +270,8 @@ def fit_and_draw_ROOT(hist, func, startval, ax, xrange=None, dont_plot_hist=Fals
                 for i in range(n+1):
                     y += pars[-1-n+i]*x**i
                 ax.plot(x, y, 'g--')
+    if return_pcov:
+        return pars, errs, chi2, ndof, prob, np.array(cov)
     return pars, errs, chi2, ndof, prob
 
 
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NumPy reader for the PMCA/DP5 `.mca` files written by the MCA8000D.
+
+The file is split into its `<<...>>` sections in a single pass and the
+`<<DATA>>` block is converted to a counts array in one bulk conversion,
+without ever going through a ROOT histogram.
+"""
+
+import re
+from datetime import datetime
+import numpy as np
+
+# the MCA8000D supports up to 8k channels (MCAC in the DP5 configuration)
+MAX_CHANNELS = 8192
+
+# counts are stored compactly, an 8k-channel spectrum takes 32 kB
+count_dtype = np.uint32
+
+# matches the section markers, e.g. `<<DATA>>` or `<<DPP STATUS END>>`
+_section_re = re.compile(br'<<([^<>\r\n]*)>>')
+
+
+# find the byte range of the body of every section
+# returns {name: (start, end)}, the end markers themselves are dropped
+def split_sections(raw):
+    sections = {}
+    markers = list(_section_re.finditer(raw))
+    for i, m in enumerate(markers):
+        name = m.group(1).decode('latin-1')
+        if name == 'END' or name.endswith(' END'):
+            continue
+        start = raw.find(b'\n', m.end())
+        start = len(raw) if start < 0 else start + 1
+        end = markers[i+1].start() if i+1 < len(markers) else len(raw)
+        sections[name] = (start, max(start, end))
+    return sections
+
+# decode the `KEY - VALUE` lines of the `<<PMCA SPECTRUM>>` header
+def _decode_header(block):
+    header = {}
+    for line in block.decode('latin-1').splitlines():
+        key, sep, value = line.partition(' - ')
+        if sep:
+            header[key.strip()] = value.strip()
+    return header
+
+# decode the `Key: value` lines of the `<<DPP STATUS>>` block
+def _decode_status(block):
+    status = {}
+    for line in block.decode('latin-1').splitlines():
+        key, sep, value = line.partition(':')
+        if sep:
+            status[key.strip()] = value.strip()
+    return status
+
+# decode the `KEY=VALUE;    Description` lines of the `<<DP5 CONFIGURATION>>` block
+def _decode_dp5(block):
+    config = {}
+    for line in block.decode('latin-1').splitlines():
+        key, sep, value = line.partition('=')
+        if sep:
+            config[key.strip()] = value.partition(';')[0].strip()
+    return config
+
+def _to_datetime64(value):
+    try:
+        return np.datetime64(datetime.strptime(value, '%m/%d/%Y %H:%M:%S'), 's')
+    except ValueError:
+        return np.datetime64('NaT', 's')
+
+
+class McaMetadata(object):
+    """
+    Metadata of one mca file.
+
+    The `<<PMCA SPECTRUM>>` header and the ROI are decoded when the file is
+    read. Only the byte offsets of the `<<DP5 CONFIGURATION>>` and
+    `<<DPP STATUS>>` sections are recorded; they are decoded on first access
+    of `dp5` or `status`.
+    """
+    __slots__ = ('filename', 'offsets', 'tag', 'description', 'gain', 'threshold',
+                 'live_mode', 'preset_time', 'live_time', 'real_time', 'start_time',
+                 'serial_number', 'roi', 'n_channels', '_raw', '_dp5', '_status')
+
+    def __init__(self, filename, offsets, header, roi, n_channels, raw=None):
+        self.filename = filename
+        self.offsets = offsets
+        self.tag = header.get('TAG', '')
+        self.description = header.get('DESCRIPTION', '')
+        self.gain = int(float(header.get('GAIN', 0)))
+        self.threshold = float(header.get('THRESHOLD', 0))
+        self.live_mode = int(header.get('LIVE_MODE', 0))
+        self.preset_time = float(header.get('PRESET_TIME', 0))
+        self.live_time = float(header.get('LIVE_TIME', 0))
+        self.real_time = float(header.get('REAL_TIME', 0))
+        self.start_time = _to_datetime64(header.get('START_TIME', ''))
+        self.serial_number = header.get('SERIAL_NUMBER', '')
+        self.roi = roi
+        self.n_channels = n_channels
+        self._raw = raw
+        self._dp5 = None
+        self._status = None
+
+    def __repr__(self):
+        return "McaMetadata({:}, {:d} channels, live time {:.1f} s)".format(self.filename, self.n_channels, self.live_time)
+
+    # eagerly decoded fields as plain python types, used by the spectrum cache
+    def to_record(self):
+        rec = dict((k, getattr(self, k)) for k in self.__slots__ if not k.startswith('_'))
+        rec['offsets'] = dict((k, list(v)) for k, v in self.offsets.items())
+        rec['roi'] = list(self.roi)
+        rec['start_time'] = str(self.start_time)
+        return rec
+
+    @classmethod
+    def from_record(cls, rec):
+        meta = cls.__new__(cls)
+        for k in cls.__slots__:
+            if not k.startswith('_'):
+                setattr(meta, k, rec[k])
+        meta.offsets = dict((k, tuple(v)) for k, v in rec['offsets'].items())
+        meta.roi = tuple(rec['roi'])
+        meta.start_time = np.datetime64(rec['start_time'], 's')
+        meta._raw = None
+        meta._dp5 = None
+        meta._status = None
+        return meta
+
+    # raw bytes of one section, read back from the file if the buffer was dropped
+    def section(self, name):
+        if name not in self.offsets:
+            return b''
+        start, end = self.offsets[name]
+        if self._raw is not None:
+            return self._raw[start:end]
+        with open(self.filename, 'rb') as f:
+            f.seek(start)
+            return f.read(end-start)
+
+    # drop the reference to the file buffer, lazy sections are then read from disk
+    def release(self):
+        self._raw = None
+
+    @property
+    def dp5(self):
+        if self._dp5 is None:
+            self._dp5 = _decode_dp5(self.section('DP5 CONFIGURATION'))
+        return self._dp5
+
+    @property
+    def status(self):
+        if self._status is None:
+            self._status = _decode_status(self.section('DPP STATUS'))
+        return self._status
+
+    # real time as reported by the DPP status, this is what mca_to_hist returns
+    @property
+    def status_real_time(self):
+        return float(self.status.get('Real Time', 0.))
+
+    @property
+    def slow_count(self):
+        return int(self.status.get('Slow Count', 0))
+
+
+# convert the `<<DATA>>` block to counts in a single call
+# the number of channels is whatever the block contains, up to MAX_CHANNELS
+def decode_data(block):
+    counts = np.fromstring(block.decode('ascii'), dtype=count_dtype, sep=' ')
+    if len(counts) > MAX_CHANNELS:
+        raise ValueError("{:d} channels in <<DATA>>, at most {:d} are supported".format(len(counts), MAX_CHANNELS))
+    return counts
+
+# read an mca file and return (counts, metadata)
+# with keep_buffer the file contents stay attached to the metadata, so the lazy
+# sections are decoded without touching the disk again
+def read_mca(filename, keep_buffer=False):
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    sections = split_sections(raw)
+
+    if 'DATA' not in sections:
+        raise ValueError("{:}: no <<DATA>> section found".format(filename))
+    start, end = sections['DATA']
+    counts = decode_data(raw[start:end])
+
+    header = {}
+    if 'PMCA SPECTRUM' in sections:
+        start, end = sections['PMCA SPECTRUM']
+        header = _decode_header(raw[start:end])
+
+    roi = (0, 0)
+    if 'ROI' in sections:
+        start, end = sections['ROI']
+        val = raw[start:end].split()
+        if len(val) >= 2:
+            roi = (int(val[0]), int(val[1]))
+
+    return counts, McaMetadata(filename, sections, header, roi, len(counts), raw if keep_buffer else None)
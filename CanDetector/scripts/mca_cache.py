@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache of decoded `.mca` spectra.
+
+Every source file gets one entry: a memory-mappable `.npy` file with the
+counts and a `.json` file with the metadata record and the size, mtime and
+SHA-1 of the file it was decoded from. An entry is fresh when size and mtime
+still match; `verify` additionally compares the content hash. The cache is
+bounded in size, the least recently used entries are evicted first.
+
+    ./mca_cache.py warm ../data/mca ../data/mcapipe
+    ./mca_cache.py verify
+"""
+
+import os
+import sys
+import json
+import glob
+import hashlib
+import argparse
+import numpy as np
+
+from mca import read_mca, McaMetadata
+
+CACHE_DIR = os.environ.get('MCA_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', '.mca_cache'))
+MAX_CACHE_BYTES = int(os.environ.get('MCA_CACHE_MAX_BYTES', 256*1024*1024))
+
+# bumped whenever the entry layout or the stored dtype changes
+CACHE_VERSION = 2
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+# size and modification time of the source file, used for the freshness check
+def source_stamp(filename):
+    st = os.stat(filename)
+    return [int(st.st_size), int(st.st_mtime*1e9)]
+
+def content_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+# path of the entry without extension, `.npy` holds the counts and `.json` the rest
+def entry_path(filename, cache_dir=None):
+    key = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir or CACHE_DIR, key)
+
+
+def _read_entry(path, mmap_mode=None):
+    with open(path+'.json') as f:
+        info = json.load(f)
+    return np.load(path+'.npy', mmap_mode=mmap_mode), info
+
+def _write_entry(path, filename, counts, meta, stamp):
+    d = os.path.dirname(path)
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    info = {'version': CACHE_VERSION, 'source': os.path.abspath(filename), 'stamp': stamp,
+            'sha1': content_hash(filename), 'meta': meta.to_record()}
+    # write to temporary files first, so a crashed run never leaves half an entry;
+    # the json is written last, an entry without it is never read
+    with open(path+'.npy.tmp', 'wb') as f:
+        np.save(f, counts)
+    with open(path+'.json.tmp', 'w') as f:
+        json.dump(info, f)
+    _replace(path+'.npy.tmp', path+'.npy')
+    _replace(path+'.json.tmp', path+'.json')
+
+def _remove_entry(path):
+    for ext in ['.json', '.npy']:
+        if os.path.exists(path+ext):
+            os.remove(path+ext)
+
+# remove least recently used entries until the cache is below max_bytes
+def evict(cache_dir=None, max_bytes=None):
+    cache_dir = cache_dir or CACHE_DIR
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for path in glob.glob(os.path.join(cache_dir, '*.json')):
+        path = path[:-len('.json')]
+        size = sum(os.path.getsize(path+ext) for ext in ['.json', '.npy'] if os.path.exists(path+ext))
+        entries.append((os.path.getmtime(path+'.json'), size, path))
+    total = sum(e[1] for e in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove_entry(path)
+        total -= size
+        removed += 1
+    return removed
+
+# load (counts, metadata) from the cache if the entry is fresh, otherwise
+# decode the file and store it
+# with mmap_mode='r' the cached counts are memory-mapped instead of read
+def load_mca(filename, use_cache=True, cache_dir=None, mmap_mode=None):
+    if not use_cache:
+        return read_mca(filename)
+    path = entry_path(filename, cache_dir)
+    stamp = source_stamp(filename)
+    if os.path.exists(path+'.json'):
+        try:
+            counts, info = _read_entry(path, mmap_mode)
+        except (IOError, OSError, ValueError, KeyError):
+            info = None
+        if info is not None and info.get('version') == CACHE_VERSION and info['stamp'] == stamp:
+            # touch the entry, eviction goes by modification time; a cache
+            # the user can not write to is still read
+            try:
+                os.utime(path+'.json', None)
+            except (IOError, OSError):
+                pass
+            meta = McaMetadata.from_record(info['meta'])
+            meta.filename = filename
+            return counts, meta
+
+    counts, meta = read_mca(filename)
+    try:
+        _write_entry(path, filename, counts, meta, stamp)
+        evict(cache_dir)
+    except (IOError, OSError):
+        # a read-only checkout still works, just without caching
+        pass
+    return counts, meta
+
+
+def _mca_files(paths):
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files += sorted(glob.glob(os.path.join(p, '*.mca')))
+        else:
+            files.append(p)
+    return files
+
+# decode all files into the cache
+def warm(paths, cache_dir=None):
+    files = _mca_files(paths)
+    for f in files:
+        load_mca(f, cache_dir=cache_dir)
+    return len(files)
+
+# check every entry against its source, returns the list of stale or broken entries
+# with repair they are decoded again (or removed if the source is gone)
+def verify(cache_dir=None, repair=False):
+    bad = []
+    for path in sorted(glob.glob(os.path.join(cache_dir or CACHE_DIR, '*.json'))):
+        path = path[:-len('.json')]
+        try:
+            counts, info = _read_entry(path)
+            source = info['source']
+            ok = info.get('version') == CACHE_VERSION and os.path.exists(source) \
+                 and info['sha1'] == content_hash(source) \
+                 and np.array_equal(counts, read_mca(source)[0])
+        except (IOError, OSError, ValueError, KeyError):
+            source, ok = path, False
+        if ok:
+            continue
+        bad.append(source)
+        if repair:
+            _remove_entry(path)
+            if os.path.exists(source):
+                load_mca(source, cache_dir=cache_dir)
+    return bad
+
+# remove all spectrum entries; the fit results (fits/), background templates
+# (backgrounds/) and pressure tables kept under the same directory stay
+def clear(cache_dir=None):
+    return evict(cache_dir, 0)
+
+
+def parseArguments(argv=None):
+    default_dirs = [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', d) for d in ['mca', 'mcapipe']]
+    parser = argparse.ArgumentParser(description="Manage the decoded mca spectrum cache")
+    parser.add_argument('command', choices=['warm', 'verify', 'clear'],
+                        help='clear removes the spectra only, not the fits/ and backgrounds/ subdirectories')
+    parser.add_argument('paths', nargs='*', help='mca files or directories to warm', default=default_dirs)
+    parser.add_argument('--cache-dir', default=None, help='default: {:}'.format(CACHE_DIR))
+    parser.add_argument('--repair', action='store_true', help='re-decode stale entries found by `verify`')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArguments(argv)
+    if args.command == 'warm':
+        print("cached {:d} files".format(warm(args.paths, args.cache_dir)))
+    elif args.command == 'verify':
+        bad = verify(args.cache_dir, args.repair)
+        for source in bad:
+            print("stale: {:}".format(source))
+        print("{:d} stale entries".format(len(bad)))
+        return 1 if bad and not args.repair else 0
+    elif args.command == 'clear':
+        print("removed {:d} entries".format(clear(args.cache_dir)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load a whole directory of `.mca` runs at once.
+
+All spectra end up in one contiguous (n_runs, n_channels) counts matrix and
+the metadata in a columnar table (a NumPy structured array), so batch fits
+and plots can work on array slices instead of lists of histograms.
+
+    counts, runs = load_run_directory("../data/mca")
+    fe_40 = counts[(runs['source'] == 'fe') & (runs['gain'] == 40)]
+"""
+
+import os
+import glob
+import numpy as np
+
+from mca import count_dtype
+from mca_cache import load_mca
+
+run_dtype = np.dtype([('filename', 'U64'),
+                      ('path', 'U256'),
+                      ('source', 'U8'),
+                      ('gain', 'i4'),
+                      ('voltage', 'i4'),
+                      ('detector', 'U8'),
+                      ('kind', 'U8'),
+                      ('live_time', 'f8'),
+                      ('real_time', 'f8'),
+                      ('start_time', 'M8[s]'),
+                      ('n_channels', 'i4'),
+                      ('roi_min', 'i4'),
+                      ('roi_max', 'i4')])
+
+# suffixes marking runs taken with the pipe detectors, everything else is the can
+detector_suffixes = {'alu': 'alu', 'cop': 'cop'}
+
+
+# split a name like `fe_40_1801.mca` or `fe_10_1224_spec_cop.mca` into
+# (source, coarse gain, voltage, detector, kind)
+# kind is 'scan' for plain HV-scan names and 'spectrum' for the long runs,
+# gain and voltage are -1 if the name does not follow the convention
+def parse_run_name(filename):
+    parts = os.path.splitext(os.path.basename(filename))[0].split('_')
+    source = parts[0]
+    try:
+        gain = int(parts[1])
+        voltage = int(parts[2])
+    except (IndexError, ValueError):
+        gain, voltage = -1, -1
+    detector = detector_suffixes.get(parts[-1], 'can') if len(parts) > 3 else 'can'
+    kind = 'scan' if len(parts) == 3 else 'spectrum'
+    return source, gain, voltage, detector, kind
+
+def _load(args):
+    filename, use_cache = args
+    return load_mca(filename, use_cache)
+
+# read every file matching pattern in directory with a thread pool
+# returns (counts, runs): counts has shape (n_runs, n_channels), shorter
+# spectra are zero padded, runs is a structured array with one row per file
+def load_run_directory(directory, pattern='*.mca', max_workers=None, use_cache=True):
+    files = sorted(glob.glob(os.path.join(directory, pattern)))
+    return load_runs(files, max_workers, use_cache)
+
+def load_runs(files, max_workers=None, use_cache=True):
+    # imported here, the catalog alone also works on python 2 without `futures`
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        loaded = list(pool.map(_load, [(f, use_cache) for f in files]))
+
+    n_channels = max([len(c) for c, _ in loaded]) if loaded else 0
+    counts = np.zeros((len(files), n_channels), dtype=count_dtype)
+    runs = np.zeros(len(files), dtype=run_dtype)
+    for i, (f, (c, meta)) in enumerate(zip(files, loaded)):
+        counts[i, :len(c)] = c
+        runs[i] = (os.path.basename(f), f) + parse_run_name(f) + \
+                  (meta.live_time, meta.real_time, meta.start_time, meta.n_channels) + tuple(meta.roi)
+    return counts, runs
+
+
+class RunCatalog(object):
+    """
+    Index of runs built from the `source_gain_voltage[_...]` file names.
+
+    The rows are kept sorted by (source, gain, voltage), queries on a prefix
+    of these columns are answered with binary searches on the sorted arrays.
+
+        catalog = RunCatalog.from_directories(["../data/mca"])
+        am_40 = catalog.select(source='am', gain=40)
+        pairs = catalog.gain_pairs('fe')
+    """
+    __slots__ = ('runs',)
+    index_columns = ('source', 'gain', 'voltage')
+
+    def __init__(self, runs):
+        order = np.lexsort((runs['voltage'], runs['gain'], runs['source']))
+        self.runs = runs[order]
+
+    # catalog from the file names alone, no file is opened
+    @classmethod
+    def from_directories(cls, directories, pattern='*.mca'):
+        files = []
+        for d in directories:
+            files += glob.glob(os.path.join(d, pattern))
+        runs = np.zeros(len(files), dtype=run_dtype)
+        runs['live_time'] = np.nan
+        runs['real_time'] = np.nan
+        runs['start_time'] = np.datetime64('NaT')
+        runs['filename'] = [os.path.basename(f) for f in files]
+        runs['path'] = files
+        parsed = [parse_run_name(f) for f in files]
+        for col, values in zip(['source', 'gain', 'voltage', 'detector', 'kind'], zip(*parsed)):
+            runs[col] = values
+        return cls(runs)
+
+    def __len__(self):
+        return len(self.runs)
+
+    # [lo, hi) range of rows matching the given index columns
+    def _range(self, **query):
+        lo, hi = 0, len(self.runs)
+        for col in self.index_columns:
+            if col not in query:
+                break
+            column = self.runs[col][lo:hi]
+            value = query.pop(col)
+            lo, hi = lo + np.searchsorted(column, value, 'left'), lo + np.searchsorted(column, value, 'right')
+        return lo, hi, query
+
+    # indices of the rows matching all keyword arguments, in index order
+    # e.g. select_index(source='am', gain=40, kind='scan')
+    def select_index(self, **query):
+        lo, hi, rest = self._range(**query)
+        idx = np.arange(lo, hi)
+        for col, value in rest.items():
+            idx = idx[self.runs[col][idx] == value]
+        return idx
+
+    def select(self, **query):
+        return self.runs[self.select_index(**query)]
+
+    # pairs of rows (i, j) of one source taken at the same voltage (within
+    # tolerance volts) with different coarse gain, as used for the coarse gain ratios
+    def gain_pairs(self, source, tolerance=0, **query):
+        idx = self.select_index(source=source, **query)
+        # within one source sort by voltage, equal voltages become neighbours
+        idx = idx[np.argsort(self.runs['voltage'][idx], kind='mergesort')]
+        volt = self.runs['voltage'][idx]
+        gain = self.runs['gain'][idx]
+        ends = np.searchsorted(volt, volt + tolerance, 'right')
+        pairs = []
+        for a in range(len(idx)):
+            for b in range(a+1, ends[a]):
+                if gain[a] != gain[b]:
+                    pairs.append((idx[a], idx[b]))
+        return pairs
+
+    # read the spectra of the given rows (all rows by default)
+    def load(self, index=None, max_workers=None, use_cache=True):
+        rows = self.runs if index is None else self.runs[index]
+        return load_runs(list(rows['path']), max_workers, use_cache)
+
+    # the given rows with live, real and start time and the ROI from the mca
+    # headers; the cached counts are only memory-mapped, not read
+    def load_times(self, index=None, use_cache=True):
+        rows = (self.runs if index is None else self.runs[index]).copy()
+        for row in rows:
+            _, meta = load_mca(row['path'], use_cache, mmap_mode='r')
+            row['live_time'], row['real_time'], row['start_time'] = meta.live_time, meta.real_time, meta.start_time
+            row['n_channels'] = meta.n_channels
+            row['roi_min'], row['roi_max'] = meta.roi
+        return rows
+
+    # index of the run of source and gain closest in voltage to each of voltages
+    # (in volts), -1 where none is within tolerance; voltages read off the supply
+    # by hand differ from those in the file names by a few volts
+    def match_index(self, source, gains, voltages, tolerance=5, **query):
+        index = np.full(len(voltages), -1, dtype=np.int64)
+        for i, (gain, voltage) in enumerate(zip(gains, voltages)):
+            idx = self.select_index(source=source, gain=int(gain), **query)
+            if len(idx):
+                dv = np.abs(self.runs['voltage'][idx] - voltage)
+                if dv.min() <= tolerance:
+                    index[i] = idx[np.argmin(dv)]
+        return index
+
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental reader for an `.mca` file that is still being written.
+
+The PMCA software rewrites the file while the spectrum builds up. McaTail
+remembers where the `<<DATA>>` block starts and the block it saw last; a
+poll only decodes the block again if the file changed, and hands back the
+per-channel increase since the previous poll. Memory use stays constant.
+
+    ./mca_stream.py ../data/mca/fe_40_1801.mca --interval 0.25
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+from mca import read_mca, split_sections, decode_data
+
+_data_marker = b'<<DATA>>'
+
+
+class McaTail(object):
+    __slots__ = ('filename', 'counts', 'n_polls', 'n_decodes', '_data_offset', '_stamp', '_block')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.counts = None
+        self.n_polls = 0
+        self.n_decodes = 0
+        self._data_offset = None
+        self._stamp = None
+        self._block = None
+
+    # locate the body of the DATA section, from the remembered offset if the
+    # marker is still where it was, otherwise by splitting the whole file
+    def _read_block(self):
+        with open(self.filename, 'rb') as f:
+            if self._data_offset is not None:
+                head = self._data_offset - len(_data_marker) - 2
+                f.seek(max(0, head))
+                raw = f.read()
+                start = raw.find(_data_marker)
+                if 0 <= start <= 2:
+                    start = raw.find(b'\n', start) + 1
+                    end = raw.find(b'<<', start)
+                    if end < 0 or raw.find(b'<<END>>', end) != end:
+                        return None
+                    return raw[start:end]
+                f.seek(0)
+            raw = f.read()
+        sections = split_sections(raw)
+        if 'DATA' not in sections:
+            return None
+        start, end = sections['DATA']
+        # without the end marker the writer is not done with the block yet
+        if raw.find(b'<<END>>', end) != end:
+            return None
+        self._data_offset = start
+        return raw[start:end]
+
+    # returns the counts added since the last poll (int64), or None if the
+    # file did not change; the first successful poll returns the full spectrum
+    def poll(self):
+        self.n_polls += 1
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        stamp = (st.st_size, st.st_mtime)
+        if stamp == self._stamp:
+            return None
+
+        block = self._read_block()
+        if block is None:
+            # half written, try again on the next poll
+            return None
+        self._stamp = stamp
+        if block == self._block:
+            return None
+
+        new = decode_data(block)
+        self.n_decodes += 1
+        self._block = block
+        if self.counts is None or len(self.counts) != len(new):
+            delta = new.astype(np.int64)
+        else:
+            delta = new.astype(np.int64) - self.counts
+            if (delta < 0).any():
+                # the acquisition was cleared and restarted
+                delta = new.astype(np.int64)
+        self.counts = new
+        return delta
+
+    # yield the delta of every change, polling every interval seconds
+    def follow(self, interval=0.25, timeout=None):
+        t0 = time.time()
+        while timeout is None or time.time()-t0 < timeout:
+            delta = self.poll()
+            if delta is not None:
+                yield delta
+            time.sleep(interval)
+
+
+# centroid and FWHM of the counts in [r_min, r_max) from the first two moments
+def roi_moments(counts, r_min, r_max):
+    y = counts[r_min:r_max].astype(np.float64)
+    x = np.arange(r_min, r_max) + 0.5
+    n = y.sum()
+    if n <= 0:
+        return 0., 0., 0.
+    mean = (x*y).sum()/n
+    sigma = np.sqrt(max(0., (x*x*y).sum()/n - mean**2))
+    return n, mean, sigma*2.*np.sqrt(2*np.log(2))
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Follow an mca file while it is being written")
+    parser.add_argument('filename')
+    parser.add_argument('-i', '--interval', type=float, default=0.25, help='seconds between polls')
+    parser.add_argument('-t', '--timeout', type=float, default=None, help='stop after this many seconds')
+    parser.add_argument('--roi', type=int, nargs=2, default=None, help='peak region, default: ROI of the file')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArguments(argv)
+    r_min, r_max = args.roi or read_mca(args.filename)[1].roi
+    tail = McaTail(args.filename)
+    try:
+        for delta in tail.follow(args.interval, args.timeout):
+            # tail.counts is the running histogram of everything seen so far
+            n, mean, fwhm = roi_moments(tail.counts, r_min, r_max)
+            print("{:} +{:d} counts, total {:d}, ROI {:d}-{:d}: {:.0f} counts, mean {:.2f}, FWHM {:.2f}".format(
+                time.strftime('%H:%M:%S'), int(delta.sum()), int(tail.counts.sum()), r_min, r_max, n, mean, fwhm))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Automatic peak search, to seed the fits instead of hand-tuned start values.
+
+Every spectrum is correlated with the negative second difference of a
+Gaussian of `width` channels (Mariscotti's smoothed second derivative): a
+constant or linear background gives zero, a peak gives a positive bump
+that crosses zero about one sigma either side of the peak. Local maxima
+that are `threshold` standard deviations above the noise are candidates.
+The cost is linear in the number of channels, and a whole
+(n_spectra, n_channels) stack is searched at once. The search is repeated
+for a few widths, as the peaks range from ~4 (Fe) to ~22 channels (Am).
+
+    peaks = find_peaks(counts)
+    am = peaks[peaks['spectrum'] == 3]
+    startval = [am['area'][0], am['position'][0], am['sigma'][0]]
+    xrange = [am['window_min'][0], am['window_max'][0]]
+
+    ./peak_search.py --source am --kind spectrum
+    ./peak_search.py --fit              # and fit a Gaussian to every candidate
+"""
+
+import sys
+import argparse
+import numpy as np
+from scipy.ndimage import correlate1d
+
+peak_dtype = np.dtype([('spectrum', 'i4'),
+                       ('position', 'f8'),
+                       ('height', 'f8'),
+                       ('sigma', 'f8'),
+                       ('area', 'f8'),
+                       ('width', 'f8'),
+                       ('significance', 'f8'),
+                       ('window_min', 'f8'),
+                       ('window_max', 'f8')])
+
+
+# Gaussian smoothing kernel and the negative second difference of it
+def search_kernels(width):
+    half = int(np.ceil(4*width))
+    t = np.arange(-half, half+1, dtype=np.float64)
+    smooth = np.exp(-t**2/(2.*width**2))
+    smooth /= smooth.sum()
+    curvature = -np.convolve(smooth, [1., -2., 1.])
+    # exactly zero response to a constant
+    curvature -= curvature.mean()
+    return smooth, curvature
+
+# for every channel the position of the nearest zero crossing of s to the left and
+# to the right, linearly interpolated; -1 and n_channels where there is none
+def _zero_crossings(s):
+    n = s.shape[-1]
+    idx = np.arange(n)
+    negative = s <= 0
+    left = np.maximum.accumulate(np.where(negative, idx, -1), axis=-1)
+    right = np.minimum.accumulate(np.where(negative, idx, n)[..., ::-1], axis=-1)[..., ::-1]
+
+    def interpolate(k, towards):
+        inside = (k >= 0) & (k < n) & (towards >= 0) & (towards < n)
+        a = np.take_along_axis(s, np.clip(k, 0, n-1), axis=-1)
+        b = np.take_along_axis(s, np.clip(towards, 0, n-1), axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = np.where(inside & (b != a), a/(a-b), 0.)
+        return np.where(inside, k + frac*(towards-k), k)
+    return interpolate(left, left+1), interpolate(right, right-1)
+
+# candidate peaks in y, an array of shape (n_channels,) or (n_spectra, n_channels)
+# of bin contents at channels x (bin centres, default 0.5, 1.5, ...)
+# width     smoothing in channels, about the sigma of the peaks; with several
+#           widths the best matched candidate of overlapping ones is kept (see _merge)
+# threshold significance of the smoothed second derivative in standard deviations
+# variance  of the contents, default y (Poisson); pass it for scaled or subtracted spectra
+# window    half width of the suggested fit window in sigma
+# returns a structured array of peak_dtype, sorted by spectrum and position
+def find_peaks(y, width=(2., 4., 8., 16.), threshold=5., variance=None, x=None, window=1.5, min_sigma=1.):
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    x = np.arange(y.shape[-1]) + 0.5 if x is None else np.asarray(x, dtype=np.float64)
+    variance = np.clip(y if variance is None else np.atleast_2d(variance), 0, None)
+    peaks = np.concatenate([_search(y, w, threshold, variance, x, window, min_sigma) for w in np.atleast_1d(width)])
+    if np.ndim(width) > 0:
+        peaks = _merge(peaks)
+    return peaks[np.lexsort((peaks['position'], peaks['spectrum']))]
+
+# candidates that lie within the smeared sigma of a better one in the same spectrum are
+# dropped. The sigma of a kernel much wider than the peak is lost in width² and comes
+# out near min_sigma, with the height inflated to match, although the wide kernel is
+# often the most significant; so candidates whose width is at most max_ratio times
+# their sigma (the matched filters) come first, each group by significance
+def _merge(peaks, max_ratio=2.):
+    mismatched = peaks['width'] > max_ratio*peaks['sigma']
+    peaks = peaks[np.lexsort((-peaks['significance'], mismatched))]
+    smeared = np.hypot(peaks['sigma'], peaks['width'])
+    kept = []
+    for k in range(len(peaks)):
+        same = [j for j in kept if peaks['spectrum'][j] == peaks['spectrum'][k]]
+        if not any(abs(peaks['position'][j] - peaks['position'][k]) < max(smeared[j], smeared[k]) for j in same):
+            kept.append(k)
+    return peaks[kept]
+
+def _search(y, width, threshold, variance, x, window, min_sigma):
+    smooth, curvature = search_kernels(width)
+
+    s = correlate1d(y, curvature, axis=-1, mode='nearest')
+    noise = np.sqrt(correlate1d(variance, curvature**2, axis=-1, mode='nearest'))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        significance = np.where(noise > 0, s/noise, 0.)
+
+    peak = np.zeros(y.shape, dtype=bool)
+    peak[:, 1:-1] = (s[:, 1:-1] > s[:, :-2]) & (s[:, 1:-1] >= s[:, 2:]) & (significance[:, 1:-1] > threshold)
+    rows, cols = np.nonzero(peak)
+
+    # sub-channel position from a parabola through the maximum and its neighbours
+    a, b, c = s[rows, cols-1], s[rows, cols], s[rows, cols+1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shift = np.where(a - 2*b + c < 0, 0.5*(a - c)/(a - 2*b + c), 0.)
+    binwidth = x[1] - x[0]
+    position = x[cols] + shift*binwidth
+
+    # the response of a Gaussian of sigma s_peak crosses zero at about
+    # +-sqrt(s_peak² + width²) from its centre; both sides are averaged, unless a
+    # neighbouring peak or the end of the spectrum pushes one side much further out
+    left, right = _zero_crossings(s)
+    centre = cols + shift
+    near = np.minimum(centre - left[rows, cols], right[rows, cols] - centre)
+    far = np.maximum(centre - left[rows, cols], right[rows, cols] - centre)
+    half = np.where(far < 1.5*near, (near + far)/2, near)
+    sigma = np.sqrt(np.clip(half**2 - width**2, min_sigma**2, None))*binwidth
+    smeared = np.sqrt(sigma**2 + (width*binwidth)**2)
+
+    # at the centre of a Gaussian of height h the response is h*sigma/smeared³,
+    # and zero for a linear background under it
+    height = b*smeared**3/(sigma*binwidth**2)
+
+    peaks = np.zeros(len(rows), dtype=peak_dtype)
+    peaks['spectrum'] = rows
+    peaks['position'] = position
+    peaks['height'] = height
+    peaks['sigma'] = sigma
+    peaks['area'] = height*np.sqrt(2*np.pi)*sigma
+    peaks['width'] = width*binwidth
+    peaks['significance'] = significance[rows, cols]
+    peaks['window_min'] = position - window*sigma
+    peaks['window_max'] = position + window*sigma
+    return peaks
+
+# the candidate with the largest value of key (e.g. 'significance', 'area' or 'position')
+# in every spectrum; n_spectra rows, spectrum -1 where none was found
+def strongest_peaks(peaks, n_spectra, key='significance'):
+    best = np.zeros(n_spectra, dtype=peak_dtype)
+    best['spectrum'] = -1
+    if len(peaks) == 0:
+        return best
+    order = np.lexsort((peaks[key], peaks['spectrum']))
+    last = np.r_[peaks['spectrum'][order][1:] != peaks['spectrum'][order][:-1], True]
+    chosen = peaks[order][last]
+    best[chosen['spectrum']] = chosen
+    return best
+
+# fit a Gaussian to every candidate in its window, all at once with fit_batch
+# returns pars, errs, chi2, ndof, prob, converged with one row per peak
+def fit_peaks(y, peaks, likelihood=False):
+    from fit_batch import fit_batch
+    from fit_models import gauss_single
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    return fit_batch(y[peaks['spectrum']], gauss_single,
+                     np.column_stack([peaks['area'], peaks['position'], peaks['sigma']]),
+                     np.column_stack([peaks['window_min'], peaks['window_max']]), likelihood=likelihood)
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Search peaks in every run of a directory")
+    parser.add_argument('--data', default="../data/mca")
+    parser.add_argument('--source', default=None, help='only runs of this source (fe, am, cal, bkg)')
+    parser.add_argument('--kind', default=None, help='only `scan` or `spectrum` runs')
+    parser.add_argument('-w', '--width', type=float, nargs='+', default=[2., 4., 8., 16.], help='smoothing in channels')
+    parser.add_argument('-t', '--threshold', type=float, default=5., help='significance in standard deviations')
+    parser.add_argument('--fit', action='store_true', help='fit a Gaussian to every candidate')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArguments(argv)
+    from mca_runs import load_run_directory
+    counts, runs = load_run_directory(args.data)
+    keep = np.ones(len(runs), dtype=bool)
+    if args.source is not None:
+        keep &= runs['source'] == args.source
+    if args.kind is not None:
+        keep &= runs['kind'] == args.kind
+    y, runs = counts[keep].astype(np.float64), runs[keep]
+
+    peaks = find_peaks(y, args.width, args.threshold)
+    if args.fit:
+        pars, errs, chi2, ndof, prob, converged = fit_peaks(y, peaks)
+    for k in range(len(y)):
+        print(runs['filename'][k])
+        for i in np.flatnonzero(peaks['spectrum'] == k):
+            p = peaks[i]
+            line = "    {:7.1f}  height {:9.1f}  sigma {:6.2f}  area {:10.0f}  {:6.1f} sd  window [{:.0f}, {:.0f}]".format(
+                p['position'], p['height'], p['sigma'], p['area'], p['significance'], p['window_min'], p['window_max'])
+            if args.fit:
+                line += "  fit {:8.2f} ± {:5.2f}  chi2/ndof {:6.1f}/{:3d}{:}".format(
+                    pars[i, 1], errs[i, 1], chi2[i], ndof[i], "" if converged[i] else " (not converged)")
+            print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
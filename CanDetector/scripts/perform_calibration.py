@@ -8,7 +8,8 @@ Created on Wed Oct  31 08:19:00 2018
 
 import numpy as np
 import ROOT
-from array import array
+from root_bridge import graph_errors
+from fit_batch import fit_scan
 from common import show_title, show_text
 import matplotlib.pyplot as plt
 np.random.seed(42)
@@ -31,15 +32,18 @@ np.random.seed(42)
 #cal_confs = ["10_12", "10_126", "10_144", "10_152", "10_32", "10_50", "10_79", "10_100"]
 #plot_confs(cal_confs, "Calibration", "cal")
 
-# calibration values from fits from files
+# calibration values from fits from files, the same likelihood fits of the
+# ROI as plot_confs but all at once and kept in the fit cache
+cal_runs, cal_pars, cal_errs = fit_scan('cal')
+cal_used = cal_runs['voltage'] != 152 # the 151.6 mV pulse is left out
 volt = np.array([ 12.2, 32.4, 49.8, 78.8, 99.98, 125.6, 144.0])#, 151.6 ]
 verr = np.array([ 0.220, 0.250, 0.260, 0.280, 0.300, 0.330, 0.200])#, 0.200 ]
-mean = np.array([ 72.78174428570775, 210.0788135419234, 326.80617438591594, 515.2406913592274, 657.0662425249498, 832.8401720174578, 954.6987048468875])#, 994.3395288514907 ]
+mean = cal_pars[cal_used, 1]
 #FWHM = np.array([ 1.640102628564026, 1.6065840660143793, 1.551179962733933, 1.539019813215115, 1.517681317408192, 1.5699381520492788, 1.543115523427546])#, 1.5527226864220074 ]
-mean_unc = np.array([ 0.00511876991278432, 0.00500321982192352, 0.00483271239072621, 0.00479870783938811, 0.00471302303328386, 0.00488808702421034, 0.00481756197898153])#, 0.00484989791657979 ]
+mean_unc = cal_errs[cal_used, 1]
 
 # fit calibration values to find channel to volt
-gr = ROOT.TGraphErrors( len(volt), array('d',volt), array('d',mean), array('d',verr), array('d',mean_unc) )
+gr = graph_errors(volt, mean, verr, mean_unc)
 fit1 = ROOT.TF1("fit1","pol1", 0, 1024);
 res = gr.Fit(fit1, "RS")
 #res.Print()
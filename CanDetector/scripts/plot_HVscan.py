@@ -19,6 +19,7 @@ from matplotlib.backends.backend_pdf import PdfPages
 import rootpy.plotting.root2matplotlib as rplt
 
 from common import mca_to_hist, font, font_wip
+from mca_runs import RunCatalog
 
 #######################################################################
 # Package information
@@ -221,9 +222,10 @@ def main(argv):
     
     print("am_40_1502 fit is not exactly right")
 
-    am_confs = ["100_1136", "100_1191", "100_1244", "100_1297", "100_1351", "100_1399", "10_1665", "10_1712", "10_1758", "20_1559", "20_1603", "20_1666", "2_1900", "2_1951", "2_2001", "40_1397", "40_1455", "40_1502", "40_1559", "4_1757", "4_1808", "4_1858", "4_1899"]
-
-    fe_confs = ["100_1420", "100_1470", "100_1523", "100_1572", "100_1617", "100_1717", "10_1978", "10_2000", "10_2042", "10_2080", "20_1901", "20_1978", "2_2201", "2_2254", "2_2303", "40_1717", "40_1801", "40_1853", "40_1901", "4_2080", "4_2124", "4_2201"]
+    # all HV-scan runs of the can, taken from the file names in ../data/mca
+    catalog = RunCatalog.from_directories(["../data/mca"])
+    am_confs = ["{:d}_{:d}".format(r['gain'], r['voltage']) for r in catalog.select(source='am', kind='scan')]
+    fe_confs = ["{:d}_{:d}".format(r['gain'], r['voltage']) for r in catalog.select(source='fe', kind='scan')]
 
     if 'am' in args.sample:
         plot_confs(am_confs, "Americium", "am")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Binned Poisson likelihood of a PeakModel, with gradient and curvature.
+
+The value is the likelihood ratio of Baker and Cousins,
+
+    D = -2 ln(L/L_saturated) = 2 sum (f - y + y ln(y/f)),
+
+which is distributed like a chi² and has UP = 1 like the chi², so fits of
+low-count peaks get proper likelihood fits with comparable numbers. The
+gradient 2 sum (1 - y/f) df/dp and the expected curvature 2 sum df/dp df/dp / f
+are sums over the bins, as is D. The bins of every row of a
+(n_spectra, n_channels) stack are evaluated in one vectorised call, and
+with threads > 1 blocks of channels are summed in parallel (NumPy gives
+up the GIL in exp, log and einsum).
+
+    nll = PoissonNLL(gauss_p1, counts, [[240, 285], [300, 335]])
+    value, gradient = nll.value_and_gradient(pars)      # pars of shape (2, 5)
+    scipy.optimize.minimize(nll.function(0), pars[0], jac=True, method='BFGS')
+
+    ./poisson_nll.py --synthetic 10000 --threads 4
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+
+class PoissonNLL(object):
+    """
+    -2 ln(L/L_saturated) of model for the bins inside the range of every row of
+    y (bin contents at bin centres x, default 0.5, 1.5, ...). Bins with negative
+    contents are left out; empty bins take part.
+    """
+    __slots__ = ('model', 'x', 'y', 'ylogy', 'mask', 'blocks', 'executor')
+
+    def __init__(self, model, y, xrange, x=None, threads=1):
+        from fit_batch import windows
+        if not hasattr(model, 'gradient'):
+            raise ValueError("PoissonNLL needs a model with an analytic gradient (a PeakModel), not {:}".format(model))
+        y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+        x = np.arange(y.shape[-1]) + 0.5 if x is None else np.asarray(x, dtype=np.float64)
+        xrange = np.broadcast_to(np.asarray(xrange, dtype=np.float64), (len(y), 2))
+        index, selected = windows(x, xrange)
+        self.model = model
+        self.x = x[index]
+        y = np.take_along_axis(y, index, axis=1)
+        self.mask = (selected & (y >= 0)).astype(np.float64)
+        self.y = y*self.mask
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.ylogy = np.where(self.y > 0, self.y*np.log(self.y), 0.)
+
+        threads = threads or os.cpu_count() or 1
+        width = self.x.shape[1]
+        self.blocks = [(b[0], b[-1]+1) for b in np.array_split(np.arange(width), min(threads, width)) if len(b)]
+        self.executor = None
+        if len(self.blocks) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(len(self.blocks))
+
+    # number of bins taking part in every row
+    @property
+    def n_bins(self):
+        return self.mask.sum(axis=1).astype(int)
+
+    def _block(self, pars, rows, lo, hi, order):
+        x, y, m = self.x[rows, lo:hi], self.y[rows, lo:hi], self.mask[rows, lo:hi]
+        if order == 0:
+            f = self.model.evaluate(x, pars, rows=True)
+        else:
+            f, jac = self.model.gradient(x, pars, rows=True)
+        f = np.clip(f, 1e-300, None)
+        result = [2*(m*(f - y - y*np.log(f)) + self.ylogy[rows, lo:hi]).sum(axis=1)]
+        if order >= 1:
+            result.append(2*np.einsum('ipk,ik->ip', jac, m - y/f))
+        if order >= 2:
+            result.append(2*np.einsum('ipk,iqk->ipq', jac*(m/f)[:, None, :], jac))
+        return result
+
+    # value, gradient (order 1) and expected curvature (order 2) of the rows
+    # (all by default) for pars of shape (n_rows, npar), summed over the blocks
+    def _evaluate(self, pars, rows, order):
+        rows = slice(None) if rows is None else rows
+        pars = np.asarray(pars, dtype=np.float64)
+        pars = np.broadcast_to(pars, (len(self.x[rows]),) + pars.shape[-1:])
+        if self.executor is None:
+            parts = [self._block(pars, rows, lo, hi, order) for lo, hi in self.blocks]
+        else:
+            parts = list(self.executor.map(lambda b: self._block(pars, rows, b[0], b[1], order), self.blocks))
+        return [sum(p[k] for p in parts) for k in range(order+1)]
+
+    def value(self, pars, rows=None):
+        return self._evaluate(pars, rows, 0)[0]
+
+    def value_and_gradient(self, pars, rows=None):
+        return tuple(self._evaluate(pars, rows, 1))
+
+    # value, gradient and the expected second derivatives 2 sum df/dp df/dp / f,
+    # which is also what Minuit's errors (UP = 1) are computed from
+    def value_gradient_curvature(self, pars, rows=None):
+        return tuple(self._evaluate(pars, rows, 2))
+
+    # fcn(p) -> (value, gradient) of one row, for scipy.optimize.minimize(..., jac=True)
+    def function(self, row=0):
+        rows = np.array([row])
+        def fcn(p):
+            value, gradient = self.value_and_gradient(np.asarray(p)[None, :], rows)
+            return float(value[0]), gradient[0]
+        return fcn
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Time likelihood against chi2 batch fits")
+    parser.add_argument('--synthetic', type=int, default=2000, help='number of simulated spectra')
+    parser.add_argument('--window', type=float, default=4., help='fit range in sigma either side of the peak')
+    parser.add_argument('-t', '--threads', type=int, nargs='+', default=[1, 2, 4])
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArguments(argv)
+    from fit_batch import fit_batch, synthetic_spectra
+    from gauss_seed import gauss_seed
+    from fit_models import gauss_single
+    y, truth, _ = synthetic_spectra(args.synthetic)
+    xrange = np.column_stack([truth[:, 1] - args.window*truth[:, 2], truth[:, 1] + args.window*truth[:, 2]])
+    start = gauss_seed(y, xrange)
+
+    for likelihood, threads in [(False, 1)] + [(True, t) for t in args.threads]:
+        t0 = time.time()
+        pars, errs, chi2, ndof, prob, converged = fit_batch(y, gauss_single, start, xrange, likelihood=likelihood, threads=threads)
+        elapsed = time.time() - t0
+        pull = (pars[:, 1] - truth[:, 1])/errs[:, 1]
+        print("{:10s} {:d} threads: {:d} fits in {:.3f} s, mean pull {:6.3f} ± {:5.3f}, {:d} not converged".format(
+            "likelihood" if likelihood else "chi2", threads, len(y), elapsed, np.nanmean(pull), np.nanstd(pull), int((~converged).sum())))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
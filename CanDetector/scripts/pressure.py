@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ambient pressure time series (Finnish Meteorological Institute, Helsinki).
+
+The CSV is parsed in one pass into datetime64/float64 arrays and cached in
+binary form next to the spectrum cache. Lookups are binary searches on the
+sorted time axis with linear interpolation, so matching thousands of run
+start times against a multi-year 10-minute series is a few milliseconds.
+
+    series = load_pressure()
+    p = series.at(runs['start_time'] - MCA_UTC_OFFSET)
+"""
+
+import io
+import os
+import hashlib
+import warnings
+import numpy as np
+
+from mca_cache import CACHE_DIR, source_stamp
+
+PRESSURE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data',
+                            'pressure_data_helsinki_oct31_nov2_2018.csv')
+
+# the pressure series is in UTC, START_TIME in the mca files is the local
+# time of the DAQ computer (Helsinki, EET = UTC+2 in November)
+MCA_UTC_OFFSET = np.timedelta64(2, 'h')
+
+pressure_dtype = np.dtype([('time', 'M8[s]'), ('pressure', 'f8')])
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class PressureSeries(object):
+    """
+    Pressure in hPa on a sorted time axis (UTC).
+    """
+    __slots__ = ('time', 'pressure', '_t', '_integral')
+
+    def __init__(self, time, pressure):
+        if len(time) < 2:
+            raise ValueError("a pressure series needs at least two samples to interpolate, got {:d}".format(len(time)))
+        order = np.argsort(time, kind='mergesort')
+        self.time = np.asarray(time, dtype='M8[s]')[order]
+        self.pressure = np.asarray(pressure, dtype=np.float64)[order]
+        # seconds since the epoch, and the running integral of p dt at every sample
+        self._t = self.time.astype(np.int64).astype(np.float64)
+        self._integral = np.r_[0., np.cumsum(np.diff(self._t)*(self.pressure[1:]+self.pressure[:-1])/2.)]
+
+    def __len__(self):
+        return len(self.time)
+
+    # index of the sample at or before t and the fraction towards the next one
+    def _locate(self, t):
+        t = np.asarray(t, dtype='M8[s]').astype(np.int64).astype(np.float64)
+        i = np.clip(np.searchsorted(self._t, t, 'right') - 1, 0, len(self._t)-2)
+        frac = (t - self._t[i])/(self._t[i+1] - self._t[i])
+        inside = (t >= self._t[0]) & (t <= self._t[-1])
+        return t, i, frac, inside
+
+    # pressure at arbitrary times, linearly interpolated; NaN outside the series
+    def at(self, t):
+        t, i, frac, inside = self._locate(t)
+        p = self.pressure[i] + frac*(self.pressure[i+1] - self.pressure[i])
+        return np.where(inside, p, np.nan)
+
+    # integral of p dt from the first sample up to t
+    def _integral_at(self, t):
+        t, i, frac, inside = self._locate(t)
+        p = self.pressure[i] + frac*(self.pressure[i+1] - self.pressure[i])
+        return np.where(inside, self._integral[i] + (t - self._t[i])*(self.pressure[i] + p)/2., np.nan)
+
+    # time-averaged pressure between t0 and t1 (arrays of equal shape)
+    # falls back to the value at t0 for zero-length intervals
+    def mean_between(self, t0, t1):
+        t0 = np.asarray(t0, dtype='M8[s]')
+        t1 = np.asarray(t1, dtype='M8[s]')
+        dt = (t1 - t0).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (self._integral_at(t1) - self._integral_at(t0))/dt
+        return np.where(dt > 0, mean, self.at(t0))
+
+
+# all rows of the CSV body in one pass, None if any row is malformed
+def _parse_fast(body, n_rows):
+    if body.count(b',UTC,') != n_rows or body.count(b',') != 5*n_rows or body.count(b':') != n_rows:
+        return None
+    with warnings.catch_warnings():
+        # older NumPy warns and stops at the first field it can not read, newer raises
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(body.replace(b',UTC,', b' ').replace(b',', b' ').replace(b':', b' ').decode('ascii'),
+                                   dtype=np.float64, sep=' ')
+        except (ValueError, DeprecationWarning):
+            return None
+    return values.reshape(-1, 6) if values.size == 6*n_rows else None
+
+# row by row: rows that are cut short are skipped, empty or non-numeric fields
+# (e.g. a missing reading) become NaN
+def _parse_rows(filename, body):
+    rows = [line.split(b',') for line in body.splitlines() if line.strip()]
+    rows = [r for r in rows if len(r) == 6 and r[3].count(b':') == 1]
+    if any(r[4].strip() != b'UTC' for r in rows):
+        raise ValueError("{:}: only UTC time stamps are supported".format(filename))
+    text = b'\n'.join(b','.join(r[:3] + r[3].split(b':') + r[5:]) for r in rows)
+    return np.genfromtxt(io.BytesIO(text), delimiter=',', dtype=np.float64, filling_values=np.nan).reshape(-1, 6)
+
+# parse `Year,m,d,HH:MM,Time zone,Pressure (msl) (hPa)` in one go; only if a row
+# is malformed it is parsed row by row, and rows without a valid reading are dropped
+def read_pressure_csv(filename=PRESSURE_CSV):
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    body = raw[raw.find(b'\n')+1:]
+    values = _parse_fast(body, len(body.split()))
+    if values is None:
+        values = _parse_rows(filename, body)
+        values = values[np.all(np.isfinite(values), axis=1)]
+    year, month, day, hour, minute = values[:, :5].astype(np.int64).T
+    months = ((year - 1970)*12 + month - 1).astype('M8[M]')
+    time = months.astype('M8[D]') + (day - 1).astype('m8[D]')
+    time = time.astype('M8[s]') + (hour*3600 + minute*60).astype('m8[s]')
+    return PressureSeries(time, values[:, 5])
+
+# load through the binary cache, the cache entry is tied to size and mtime of the CSV
+def load_pressure(filename=PRESSURE_CSV, use_cache=True, cache_dir=None):
+    if not use_cache:
+        return read_pressure_csv(filename)
+    key = "{:}:{:d}:{:d}".format(os.path.abspath(filename), *source_stamp(filename))
+    path = os.path.join(cache_dir or CACHE_DIR, 'pressure_'+hashlib.sha1(key.encode('utf-8')).hexdigest()+'.npy')
+    if os.path.exists(path):
+        table = np.load(path)
+        return PressureSeries(table['time'], table['pressure'])
+
+    series = read_pressure_csv(filename)
+    table = np.zeros(len(series), dtype=pressure_dtype)
+    table['time'] = series.time
+    table['pressure'] = series.pressure
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path+'.tmp', 'wb') as f:
+            np.save(f, table)
+        _replace(path+'.tmp', path)
+    except (IOError, OSError):
+        pass
+    return series
+
+
+# time-averaged gas density ratio rho/rho_0 = (p/1 bar)/(T/T_0) of every row of
+# a run table over its acquisition, START_TIME to START_TIME + real time;
+# NaN for runs without a start time or outside the pressure series
+def run_density_ratio(runs, series=None, temperature=1.0):
+    if series is None:
+        series = load_pressure()
+    t0 = runs['start_time'] - MCA_UTC_OFFSET
+    duration = np.round(np.nan_to_num(runs['real_time'])).astype(np.int64).astype('m8[s]')
+    return series.mean_between(t0, t0 + duration)/1000./temperature
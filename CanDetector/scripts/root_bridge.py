@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Move NumPy arrays in and out of ROOT histograms, graphs and functions in bulk.
+
+Histograms are filled with one SetContent/SetError call from a contiguous
+float64 buffer, and read back through the bin array ROOT holds in memory.
+Pools hand out TH1D and TF1 objects that are created once and reused, the
+histograms are detached from gDirectory, so repeated fits no longer leave
+a new histogram and function behind every time.
+
+    pool = HistPool()
+    h = pool.acquire(1024, 0, 1024)
+    fill_hist(h, counts, np.sqrt(counts))
+    ...
+    pool.release(h)
+"""
+
+import numpy as np
+import ROOT
+
+_dtypes = {'TH1D': np.float64, 'TH1F': np.float32, 'TH1I': np.int32, 'TH1S': np.int16, 'TH1C': np.int8}
+
+
+# NumPy view of a C array owned by ROOT (no copy)
+def _view(pointer, dtype, n):
+    if n == 0:
+        return np.zeros(0, dtype=dtype)
+    if hasattr(pointer, 'reshape'):
+        # cppyy low level view, needs to be told its length
+        pointer.reshape((n,))
+    else:
+        # buffer of the old PyROOT
+        pointer.SetSize(n)
+    return np.frombuffer(pointer, dtype=dtype, count=n)
+
+def _float64(a):
+    return np.ascontiguousarray(a, dtype=np.float64)
+
+
+# bin contents (and errors) including under- and overflow as arrays of length nbins+2
+# with copy=False the contents are a view on the histogram's own memory
+def hist_contents(hist, copy=True):
+    n = hist.GetNbinsX() + 2
+    dtype = [d for name, d in _dtypes.items() if hist.InheritsFrom(name)]
+    contents = _view(hist.GetArray(), dtype[0] if dtype else np.float64, n)
+    return contents.astype(np.float64) if copy else contents
+
+def hist_errors(hist):
+    n = hist.GetNbinsX() + 2
+    if hist.GetSumw2N() == 0:
+        return np.sqrt(np.abs(hist_contents(hist)))
+    return _view(hist.GetSumw2().GetArray(), np.float64, n).copy()**0.5
+
+# bin centres and contents of bins 1..n
+def hist_arrays(hist):
+    n = hist.GetNbinsX()
+    axis = hist.GetXaxis()
+    edges = _view(axis.GetXbins().GetArray(), np.float64, n+1).copy() if axis.IsVariableBinSize() \
+            else np.linspace(axis.GetXmin(), axis.GetXmax(), n+1)
+    return (edges[:-1] + edges[1:])/2, hist_contents(hist)[1:n+1]
+
+# set all bins at once, contents (and errors) of length nbins (without
+# under- and overflow, which are set to 0) or nbins+2
+def fill_hist(hist, contents, errors=None):
+    n = hist.GetNbinsX()
+    def padded(a):
+        a = _float64(a)
+        if len(a) == n:
+            a = np.concatenate([[0.], a, [0.]])
+        return a
+    hist.SetContent(padded(contents))
+    if errors is not None:
+        hist.SetError(padded(errors))
+    hist.SetEntries(n)
+    return hist
+
+
+class HistPool(object):
+    """
+    TH1D objects by binning, detached from gDirectory and reused after release.
+    """
+    __slots__ = ('free', 'n_created')
+
+    def __init__(self):
+        self.free = {}
+        self.n_created = 0
+
+    def acquire(self, nbins, xmin, xmax):
+        key = (int(nbins), float(xmin), float(xmax))
+        if self.free.get(key):
+            hist = self.free[key].pop()
+            hist.Reset()
+            return hist
+        self.n_created += 1
+        name = "pool_h{:d}".format(self.n_created)
+        hist = ROOT.TH1D(name, name, key[0], key[1], key[2])
+        hist.SetDirectory(0)
+        hist.Sumw2()
+        return hist
+
+    def release(self, hist):
+        axis = hist.GetXaxis()
+        self.free.setdefault((hist.GetNbinsX(), axis.GetXmin(), axis.GetXmax()), []).append(hist)
+
+
+class FunctionPool(object):
+    """
+    One TF1 per model and parameter count, reused for every fit with it.
+    Range and parameter limits are reset when the function is handed out.
+    """
+    __slots__ = ('functions',)
+
+    def __init__(self):
+        self.functions = {}
+
+    def get(self, key, make, xmin, xmax, npar):
+        f = self.functions.get((key, npar))
+        if f is None:
+            f = self.functions[(key, npar)] = make()
+        f.SetRange(xmin, xmax)
+        for i in range(npar):
+            f.ReleaseParameter(i)
+        return f
+
+
+# TGraphErrors from arrays; PyROOT passes contiguous float64 arrays on as
+# pointers, only other dtypes or strided arrays are copied once
+# an existing graph is refilled in place
+def graph_errors(x, y, ex=None, ey=None, graph=None):
+    x, y = _float64(x), _float64(y)
+    ex = np.zeros(len(x)) if ex is None else _float64(ex)
+    ey = np.zeros(len(x)) if ey is None else _float64(ey)
+    if graph is None:
+        return ROOT.TGraphErrors(len(x), x, y, ex, ey)
+    graph.Set(len(x))
+    for pointer, values in [(graph.GetX(), x), (graph.GetY(), y), (graph.GetEX(), ex), (graph.GetEY(), ey)]:
+        _view(pointer, np.float64, len(x))[:] = values
+    return graph
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Continuum under the peaks of a spectrum, estimated from the spectrum itself.
+
+The SNIP algorithm (statistics-sensitive non-linear iterative peak
+clipping, as TSpectrum::Background does it): the contents are compressed
+with the LLS operator v = ln(ln(sqrt(y + 1) + 1) + 1), then for clipping
+windows p from `iterations` down to 1 every channel is replaced by
+
+    v_i = min(v_i, (v_{i-p} + v_{i+p})/2)
+
+and the result is transformed back. Peaks narrower than the largest window
+are clipped away, the slowly varying continuum stays. Each window is one
+array operation over all channels of all runs, O(n iterations) in total,
+and no separate background run is needed.
+
+    continuum = snip_background(counts, 24)      # counts of shape (n,) or (n_runs, n)
+    x, y, yerr = subtract_snip(counts, scale, 24)
+
+    ./snip.py                                   # the can spectra, compared with the background run
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+
+from bkg_subtraction import channel_centres
+
+
+# the LLS operator and its inverse
+def lls(y):
+    return np.log(np.log(np.sqrt(np.clip(y, 0., None) + 1.) + 1.) + 1.)
+
+def lls_inverse(v):
+    return (np.exp(np.exp(v) - 1.) - 1.)**2 - 1.
+
+# continuum of counts (shape (n,) or (n_runs, n)) after clipping with windows of
+# 1..iterations channels; decreasing=True starts with the widest window, which
+# gives the smoother continuum (kBackDecreasingWindow). Channels closer to the
+# edge than the window are not clipped, as in TSpectrum.
+def snip_background(counts, iterations=24, decreasing=True, use_lls=True):
+    counts = np.asarray(counts, dtype=np.float64)
+    v = np.atleast_2d(counts)
+    v = lls(v) if use_lls else v.copy()
+    n = v.shape[1]
+    windows = range(min(iterations, (n-1)//2), 0, -1) if decreasing else range(1, min(iterations, (n-1)//2) + 1)
+    for p in windows:
+        np.minimum(v[:, p:n-p], (v[:, :n-2*p] + v[:, 2*p:])/2, out=v[:, p:n-p])
+    if use_lls:
+        v = lls_inverse(v)
+    return v.reshape(counts.shape)
+
+# signal (counts of n channels, shape (n,) or (n_runs, n)) scaled by scale (scalar
+# or one per run) minus its own SNIP continuum, clipped at zero like subtract_background
+# returns the centres of channels 1..n, contents and errors of the shape of signal;
+# the errors are those of the signal, the continuum is taken as exact
+def subtract_snip(signal, scale=1., iterations=24, decreasing=True):
+    signal = np.asarray(signal, dtype=np.float64)
+    stack = np.atleast_2d(signal)
+    scale = np.broadcast_to(np.asarray(scale, dtype=np.float64), (len(stack),))[:, None]
+    # clipped on the counts, the LLS operator assumes Poisson statistics
+    values = np.fmax(stack - snip_background(stack, iterations, decreasing), 0.)*scale
+    errors = np.sqrt(stack)*scale
+    x = channel_centres(stack.shape[1])[1:]
+    if signal.ndim == 1:
+        return x, values[0], errors[0]
+    return x, values, errors
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Estimate the continuum of the can spectra with SNIP")
+    parser.add_argument('--data', default="../data/mca")
+    parser.add_argument('--runs', nargs='+', default=["fe_4_1937_spectrum", "am_4_1937_spectrum"])
+    parser.add_argument('--background', default="bkg_4_1937_spectrum", help='background run to compare with')
+    parser.add_argument('-i', '--iterations', type=int, default=24, help='largest clipping window in channels')
+    parser.add_argument('--scan', action='store_true', help='time SNIP on every run of the data directory')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArguments(argv)
+    from mca_cache import load_mca
+    from bkg_subtraction import subtract_background
+    runs = [load_mca("{:}/{:}.mca".format(args.data, r)) for r in args.runs]
+    counts_bkg, meta_bkg = load_mca("{:}/{:}.mca".format(args.data, args.background))
+    time_ref = runs[0][1].status_real_time
+    signal = np.array([c for c, _ in runs], dtype=np.float64)
+    scale = np.array([time_ref/m.status_real_time for _, m in runs])
+
+    x, y, yerr = subtract_snip(signal, scale, args.iterations)
+    _, y_run, _ = subtract_background(signal, scale, counts_bkg, time_ref/meta_bkg.status_real_time)
+    for name, values, reference in zip(args.runs, y, y_run):
+        print("{:24s} {:10.1f} counts after SNIP, {:10.1f} after subtracting the background run".format(
+            name, values.sum(), reference.sum()))
+
+    if args.scan:
+        from mca_runs import RunCatalog
+        counts, _ = RunCatalog.from_directories([args.data]).load()
+        t0 = time.time()
+        snip_background(counts, args.iterations)
+        print("continuum of {:d} runs of {:d} channels in {:.1f} ms".format(len(counts), counts.shape[1], (time.time() - t0)*1e3))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Spectra as NumPy arrays: contents, variance, bin edges and the times of the run.
+
+A Spectrum does what the scripts do with rootpy Hists (Scale, Clone, Add,
+Rebin, reading contents back) on contiguous arrays, without creating ROOT
+objects or crossing into C++ for every bin. Errors are propagated through
+the variance: sums add variances, scaling by a multiplies them by a².
+Contents may also be a stack of runs of shape (n_runs, n_bins) with one
+time per run; all operations then act on every run at once. ROOT is only
+needed to convert to and from TH1 at the edges, e.g. to fit or draw.
+
+    fe = Spectrum.from_mca("../data/mca/fe_4_1937_spectrum.mca")
+    bkg = Spectrum.from_mca("../data/mca/bkg_4_1937_spectrum.mca")
+    net = fe - bkg.scaled_to(fe.real_time, 'real_time')
+    h = net.rebin(4)[10:200].to_hist()
+
+    ./spectrum.py                       # compares the arithmetic with TH1, if ROOT is there
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+
+
+class Spectrum(object):
+    """
+    Contents and variance of the bins between edges (n+1 values, one bin per
+    channel from 0 by default), live and real time of the run in seconds.
+    The variance defaults to the contents, Poisson errors of raw counts.
+    real_time is the real time of the DPP status, the time mca_to_hist returns.
+    """
+    __slots__ = ('counts', 'variance', 'edges', 'live_time', 'real_time')
+
+    def __init__(self, counts, variance=None, edges=None, live_time=np.nan, real_time=np.nan):
+        self.counts = np.ascontiguousarray(counts, dtype=np.float64)
+        self.variance = self.counts.copy() if variance is None else np.ascontiguousarray(variance, dtype=np.float64)
+        n = self.counts.shape[-1]
+        self.edges = np.arange(n+1, dtype=np.float64) if edges is None else np.ascontiguousarray(edges, dtype=np.float64)
+        if self.variance.shape != self.counts.shape:
+            raise ValueError("variance of shape {:} for contents of shape {:}".format(self.variance.shape, self.counts.shape))
+        if len(self.edges) != n+1:
+            raise ValueError("{:d} edges for {:d} bins".format(len(self.edges), n))
+        self.live_time = live_time
+        self.real_time = real_time
+
+    # spectrum of an mca file, through the spectrum cache
+    @classmethod
+    def from_mca(cls, filename, use_cache=True):
+        from mca_cache import load_mca
+        counts, meta = load_mca(filename, use_cache)
+        return cls(counts, live_time=meta.live_time, real_time=meta.status_real_time)
+
+    # stack of runs, counts and runs as returned by RunCatalog.load
+    # (real_time is then the one of the mca header)
+    @classmethod
+    def from_runs(cls, counts, runs):
+        return cls(counts, live_time=runs['live_time'].astype(np.float64), real_time=runs['real_time'].astype(np.float64))
+
+    # contents, errors and binning of bins 1..n of a ROOT histogram
+    @classmethod
+    def from_hist(cls, hist, live_time=np.nan, real_time=np.nan):
+        from root_bridge import hist_contents, hist_errors, _view
+        n = hist.GetNbinsX()
+        axis = hist.GetXaxis()
+        edges = _view(axis.GetXbins().GetArray(), np.float64, n+1).copy() if axis.IsVariableBinSize() \
+                else np.linspace(axis.GetXmin(), axis.GetXmax(), n+1)
+        return cls(hist_contents(hist)[1:n+1], hist_errors(hist)[1:n+1]**2, edges, live_time, real_time)
+
+    # TH1D with these contents and errors, detached from gDirectory, or hist filled
+    # with them (e.g. one from a HistPool); a single spectrum only
+    def to_hist(self, hist=None, name="spectrum"):
+        import ROOT
+        from root_bridge import fill_hist
+        if self.counts.ndim != 1:
+            raise ValueError("only a single spectrum converts to a histogram, this is a stack of {:d}".format(len(self.counts)))
+        if hist is None:
+            if self.uniform:
+                hist = ROOT.TH1D(name, name, self.n_bins, self.edges[0], self.edges[-1])
+            else:
+                hist = ROOT.TH1D(name, name, self.n_bins, self.edges)
+            hist.SetDirectory(0)
+            hist.Sumw2()
+        elif hist.GetNbinsX() != self.n_bins:
+            raise ValueError("{:} has {:d} bins, the spectrum {:d}".format(hist.GetName(), hist.GetNbinsX(), self.n_bins))
+        return fill_hist(hist, self.counts, self.errors)
+
+    def copy(self):
+        return Spectrum(self.counts.copy(), self.variance.copy(), self.edges.copy(), self.live_time, self.real_time)
+
+    @property
+    def n_bins(self):
+        return self.counts.shape[-1]
+
+    def __len__(self):
+        return self.n_bins
+
+    @property
+    def errors(self):
+        return np.sqrt(np.clip(self.variance, 0., None))
+
+    @property
+    def centres(self):
+        return (self.edges[:-1] + self.edges[1:])/2
+
+    @property
+    def widths(self):
+        return np.diff(self.edges)
+
+    # equal bins, as the fits of fit_scheduler need
+    @property
+    def uniform(self):
+        return np.allclose(self.widths, self.widths[0], rtol=1e-12, atol=0.)
+
+    # True for a spectrum of the same binning, False for anything else
+    def _check(self, other):
+        if not isinstance(other, Spectrum):
+            return False
+        if len(self.edges) != len(other.edges) or not np.allclose(self.edges, other.edges, rtol=1e-12, atol=0.):
+            raise ValueError("spectra with different binning can not be combined, rebin first")
+        return True
+
+    # runs added bin by bin, as TH1::Add: variances and times add up
+    def __add__(self, other):
+        if not self._check(other):
+            return NotImplemented
+        return Spectrum(self.counts + other.counts, self.variance + other.variance, self.edges,
+                        np.add(self.live_time, other.live_time), np.add(self.real_time, other.real_time))
+
+    # other subtracted (e.g. a background scaled to this run): variances add up,
+    # the times stay those of this run
+    def __sub__(self, other):
+        if not self._check(other):
+            return NotImplemented
+        return Spectrum(self.counts - other.counts, self.variance + other.variance, self.edges, self.live_time, self.real_time)
+
+    # contents times factor, as TH1::Scale: a scalar or one per bin, or with
+    # per_run=True one per run of a stack; the times of the run are kept
+    def scale(self, factor, per_run=False):
+        factor = np.asarray(factor, dtype=np.float64)
+        if per_run:
+            if self.counts.ndim != 2 or factor.shape != (len(self.counts),):
+                raise ValueError("per-run factors of shape {:} for {:}".format(factor.shape, self))
+            factor = factor[:, None]
+        return Spectrum(self.counts*factor, self.variance*factor**2, self.edges, self.live_time, self.real_time)
+
+    def __mul__(self, factor):
+        if isinstance(factor, Spectrum):
+            return NotImplemented
+        return self.scale(factor)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, factor):
+        if isinstance(factor, Spectrum):
+            return NotImplemented
+        return self.scale(1./np.asarray(factor, dtype=np.float64))
+
+    # scaled to what it would be after time (seconds of clock, 'live_time' or
+    # 'real_time'), as get_draw_spline does with time_to_norm_to/time_hist
+    def scaled_to(self, time, clock='live_time'):
+        factor = np.divide(time, getattr(self, clock))
+        return self.scale(factor, per_run=np.ndim(factor) == 1)
+
+    # count rate per second of clock
+    def rate(self, clock='live_time'):
+        return self.scaled_to(1., clock)
+
+    # groups of ngroup bins merged (TH1::Rebin(ngroup), the bins left over at the
+    # end are dropped), or merged into new edges, which have to be among the edges
+    def rebin(self, ngroup_or_edges):
+        if np.ndim(ngroup_or_edges) == 0:
+            ngroup = int(ngroup_or_edges)
+            if ngroup < 1:
+                raise ValueError("can not rebin by {:d}".format(ngroup))
+            index = np.arange(self.n_bins//ngroup + 1)*ngroup
+        else:
+            edges = np.asarray(ngroup_or_edges, dtype=np.float64)
+            index = np.clip(np.searchsorted(self.edges, edges), 0, self.n_bins)
+            if not np.allclose(self.edges[index], edges, rtol=1e-12, atol=0.) or np.any(np.diff(index) <= 0):
+                raise ValueError("new edges have to be increasing edges of the spectrum")
+        if len(index) < 2:
+            raise ValueError("rebinning leaves no bins")
+        # reduceat sums from each start to the next, the last bin ends at index[-1]
+        lo, hi = index[0], index[-1]
+        counts = np.add.reduceat(self.counts[..., lo:hi], index[:-1] - lo, axis=-1)
+        variance = np.add.reduceat(self.variance[..., lo:hi], index[:-1] - lo, axis=-1)
+        return Spectrum(counts, variance, self.edges[index], self.live_time, self.real_time)
+
+    # bins of a slice (in bins, step 1), e.g. spectrum[10:200]; an integer gives
+    # the run of that row of a stack
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError("spectra are sliced with step 1, use rebin to merge bins")
+            lo, hi, _ = index.indices(self.n_bins)
+            hi = max(lo, hi)
+            return Spectrum(self.counts[..., lo:hi], self.variance[..., lo:hi], self.edges[lo:hi+1], self.live_time, self.real_time)
+        if self.counts.ndim != 2:
+            raise TypeError("spectra are indexed with slices of bins")
+        pick = lambda t: t[index] if np.ndim(t) else t
+        return Spectrum(self.counts[index], self.variance[index], self.edges, pick(self.live_time), pick(self.real_time))
+
+    # bins with centres inside [xmin, xmax], as the fit ranges select them
+    def window(self, xmin, xmax):
+        inside = np.nonzero((self.centres >= xmin) & (self.centres <= xmax))[0]
+        return self[inside[0]:inside[-1]+1] if len(inside) else self[0:0]
+
+    # sum of the contents and its error (of every run for a stack)
+    def integral(self):
+        return self.counts.sum(axis=-1), np.sqrt(np.clip(self.variance.sum(axis=-1), 0., None))
+
+    def __repr__(self):
+        runs = "" if self.counts.ndim == 1 else "{:d} runs of ".format(len(self.counts))
+        return "Spectrum({:}{:d} bins from {:g} to {:g})".format(runs, self.n_bins, self.edges[0], self.edges[-1])
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Subtract the scaled background from the can spectra as Spectrum and as TH1")
+    parser.add_argument('--data', default="../data/mca")
+    parser.add_argument('--runs', nargs='+', default=["fe_4_1937_spectrum", "am_4_1937_spectrum"])
+    parser.add_argument('--background', default="bkg_4_1937_spectrum")
+    parser.add_argument('--rebin', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=100)
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArguments(argv)
+    runs = [Spectrum.from_mca("{:}/{:}.mca".format(args.data, r)) for r in args.runs]
+    bkg = Spectrum.from_mca("{:}/{:}.mca".format(args.data, args.background))
+
+    t0 = time.time()
+    for _ in range(args.repeat):
+        net = [(s - bkg.scaled_to(s.real_time, 'real_time')).rebin(args.rebin) for s in runs]
+    elapsed = (time.time() - t0)/args.repeat
+    for name, s in zip(args.runs, net):
+        total, error = s.integral()
+        print("{:24s} {:10.1f} ± {:6.1f} net counts in {:d} bins".format(name, total, error, s.n_bins))
+    print("{:d} subtractions in {:.3f} ms".format(len(runs), elapsed*1e3))
+
+    try:
+        import ROOT
+    except ImportError:
+        print("no ROOT, not compared with TH1")
+        return 0
+    t0 = time.time()
+    for _ in range(args.repeat):
+        hists = []
+        for s in runs:
+            h, h_bkg = s.to_hist(name="h_sig"), bkg.to_hist(name="h_bkg")
+            h.Add(h_bkg, -s.real_time/bkg.real_time)
+            hists.append(h.Rebin(args.rebin))
+    elapsed_root = (time.time() - t0)/args.repeat
+    for name, s, h in zip(args.runs, net, hists):
+        other = Spectrum.from_hist(h)
+        print("{:24s} max |difference to TH1| contents {:.2g}, errors {:.2g}".format(
+            name, np.max(np.abs(other.counts - s.counts)), np.max(np.abs(other.errors - s.errors))))
+    print("{:d} subtractions with TH1 in {:.3f} ms".format(len(runs), elapsed_root*1e3))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
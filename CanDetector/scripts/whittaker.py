@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Whittaker smoother (penalised least squares) for a whole stack of spectra.
+
+The smoothed spectrum z minimises sum (y - z)² + lam sum (Δ^d z)², so
+
+    (I + lam D^T D) z = y
+
+with the d-th difference matrix D. The band matrix depends on lam only: it
+is factorised once per smoothing level (banded Cholesky) and solved for
+all runs of that level in one call. lam is chosen for every run by
+generalised cross-validation on a logarithmic grid,
+
+    GCV(lam) = n RSS(lam) / (n - tr H(lam))²,   H = (I + lam D^T D)^-1.
+
+The diagonal of H, and the band of H that the errors need, come from the
+Cholesky factor by the Takahashi recursion (selected inverse), O(n d w)
+for a band of w diagonals, so nothing of size n² is ever built. Unlike
+splrep's smoothing factor, lam does not depend on the scale of the
+spectrum, and no value has to be picked by hand.
+
+    z, lam = gcv_smooth(counts)                 # counts of shape (n_runs, n_channels)
+    z = whittaker_smooth(counts, 1e3)
+
+    ./whittaker.py                              # every run in ../data/mca and ../data/mcapipe
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+from scipy.linalg import cholesky_banded, cho_solve_banded
+
+# default grid of smoothing levels, 4 per decade
+gcv_grid = np.logspace(-2, 8, 41)
+
+# rows of H further out than the band of the variance are below this fraction of the diagonal
+variance_tolerance = 1e-8
+
+_penalties = {}
+
+
+# D^T D of the order-th differences of n points in upper band storage, built
+# directly from the coefficients of the differences
+def difference_penalty(n, order=2):
+    if (n, order) not in _penalties:
+        c = np.diff(np.eye(order+1), order, axis=0)[0]
+        band = np.zeros((order+1, n))
+        for k in range(order+1):
+            for j in range(order+1-k):
+                band[order-k, j+k:j+k+n-order] += c[j]*c[j+k]
+        _penalties[(n, order)] = band
+    return _penalties[(n, order)]
+
+# banded Cholesky factor of I + lam D^T D
+def whittaker_factor(n, lam, order=2):
+    band = lam*difference_penalty(n, order)
+    band[-1] += 1.
+    return cholesky_banded(band), False
+
+# band of the inverse of U^T U for upper Cholesky factors u (upper band storage,
+# shape (..., b+1, n), any number of them at once) by the Takahashi recursion,
+# from the last row up: S_ij = -sum_{k=i+1}^{i+b} U_ik S_kj/U_ii for j = i+1..i+width,
+# which only needs rows below, then S_ii = (1/U_ii - sum_k U_ik S_ik)/U_ii
+# returns s of shape (..., width+1, n) with s[..., o, i] = S_i,i+o (0 beyond n)
+def inverse_band(u, width):
+    b, n = u.shape[-2] - 1, u.shape[-1]
+    width = max(width, b)
+    lead = u.shape[:-2]
+    # zero padded past the end, the last rows need no special case
+    upper = np.zeros(lead + (b+1, n+width+b))
+    upper[..., :n] = u
+    s = np.zeros(lead + (width+1, n+width+b))
+    m = np.arange(1, b+1)[:, None]
+    o = np.arange(1, width+1)[None, :]
+    # S_i+m,i+o is stored in the row of the smaller of the two
+    offset, shift = np.abs(o - m), np.minimum(o, m)
+    rows = b - m[:, 0]                        # where U_i,i+m is stored
+    for i in range(n-1, -1, -1):
+        coupling = upper[..., rows, i+m[:, 0]]
+        diagonal = upper[..., b, i]
+        s[..., 1:, i] = -np.einsum('...m,...mo->...o', coupling, s[..., offset, i+shift])/diagonal[..., None]
+        s[..., 0, i] = (1./diagonal - np.einsum('...m,...m->...', coupling, s[..., 1:b+1, i]))/diagonal
+    return s[..., :n]
+
+# trace of the smoother matrix, the effective number of parameters; lam one value
+# or an array of them
+def effective_parameters(n, lam, order=2):
+    lam = np.asarray(lam, dtype=np.float64)
+    factors = np.array([whittaker_factor(n, level, order)[0] for level in lam.ravel()])
+    return inverse_band(factors, order)[:, 0].sum(axis=-1).reshape(lam.shape)
+
+# y of shape (n,) or (n_runs, n) smoothed with lam, one value or one per run;
+# runs with the same lam share one factorisation
+def whittaker_smooth(y, lam, order=2):
+    y = np.asarray(y, dtype=np.float64)
+    stack = np.atleast_2d(y)
+    lam = np.broadcast_to(np.asarray(lam, dtype=np.float64), (len(stack),))
+    z = np.empty_like(stack)
+    for level in np.unique(lam):
+        rows = lam == level
+        z[rows] = cho_solve_banded(whittaker_factor(stack.shape[1], level, order), stack[rows].T).T
+    return z.reshape(y.shape)
+
+# variance of whittaker_smooth(y, lam) for contents of the given variance (shape of y),
+# sum_j H_ij² var_j over the band of H outside which its rows are negligible; the band
+# starts at 16 lam^(1/2d), the scale of the smoothing kernel, and is doubled until the
+# outermost diagonal is below variance_tolerance
+def whittaker_variance(variance, lam, order=2):
+    variance = np.asarray(variance, dtype=np.float64)
+    stack = np.atleast_2d(variance)
+    n = stack.shape[1]
+    lam = np.broadcast_to(np.asarray(lam, dtype=np.float64), (len(stack),))
+    result = np.empty_like(stack)
+    for level in np.unique(lam):
+        rows = lam == level
+        factor = whittaker_factor(n, level, order)[0]
+        width = min(n-1, max(order, int(np.ceil(16*level**(0.5/order)))))
+        while True:
+            h = inverse_band(factor, width)
+            if width == n-1 or np.max(np.abs(h[-1])) <= variance_tolerance*np.max(h[0]):
+                break
+            width = min(n-1, 2*width)
+        v = stack[rows]
+        # the diagonal and both sides of every row of H
+        total = v*h[0]**2
+        for o in range(1, width+1):
+            total[:, :n-o] += h[o, :n-o]**2*v[:, o:]
+            total[:, o:] += h[o, :n-o]**2*v[:, :n-o]
+        result[rows] = total
+    return result.reshape(variance.shape)
+
+# every run smoothed with the lam of grid that minimises its GCV
+# returns z (shape of y) and lam (one per run, a scalar for a single spectrum)
+def gcv_smooth(y, grid=gcv_grid, order=2):
+    y = np.asarray(y, dtype=np.float64)
+    stack = np.atleast_2d(y)
+    n = stack.shape[1]
+    # from smooth to rough, equal GCV (e.g. an empty spectrum) keeps the smoothest
+    grid = np.sort(np.asarray(grid, dtype=np.float64))[::-1]
+    trace = effective_parameters(n, grid, order)
+    best = np.full(len(stack), np.inf)
+    z = np.zeros_like(stack)
+    lam = np.zeros(len(stack))
+    for level, tr in zip(grid, trace):
+        smoothed = cho_solve_banded(whittaker_factor(n, level, order), stack.T).T
+        gcv = n*np.sum((stack - smoothed)**2, axis=1)/(n - tr)**2
+        better = gcv < best
+        best[better], z[better], lam[better] = gcv[better], smoothed[better], level
+    if y.ndim == 1:
+        return z[0], lam[0]
+    return z, lam
+
+# z, smoothed at bin centres x, as a function like the splines of get_draw_spline:
+# linear between the centres, nan outside
+def smoothed_function(x, z):
+    x, z = np.asarray(x, dtype=np.float64), np.asarray(z, dtype=np.float64)
+    return lambda v: np.interp(v, x, z, left=np.nan, right=np.nan)
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Smooth every run with a GCV-tuned Whittaker smoother")
+    parser.add_argument('--data', nargs='+', default=["../data/mca", "../data/mcapipe"])
+    parser.add_argument('-d', '--order', type=int, default=2, help='order of the differences')
+    parser.add_argument('--repeat', type=int, default=1, help='stack the runs this many times, for timing')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parseArguments(argv)
+    from mca_runs import RunCatalog
+    catalog = RunCatalog.from_directories(args.data)
+    counts, runs = catalog.load()
+    y = np.tile(counts.astype(np.float64), (args.repeat, 1))
+
+    t0 = time.time()
+    z, lam = gcv_smooth(y, order=args.order)
+    elapsed = time.time() - t0
+
+    levels = np.unique(lam)
+    trace = dict(zip(levels, effective_parameters(y.shape[1], levels, args.order)))
+    for name, l, row, smooth in zip(runs['filename'], lam, y, z):
+        print("{:28s} lam {:8.3g}  effective parameters {:6.1f}  rms residual {:7.2f}".format(
+            name, l, trace[l], np.sqrt(np.mean((row - smooth)**2))))
+    print("{:d} runs smoothed with GCV over {:d} levels in {:.1f} ms".format(len(y), len(gcv_grid), elapsed*1e3))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,12 +1,17 @@
 # Remember to set up ROOT in your environment before running this script, as several ROOT functions are used
 import numpy as np
 from ROOT import TCanvas, TGraphErrors, TGraph, TF1, kBlack, gStyle, TRandom3, TH1D, TLatex
-from array import array
 import sys
 from math import sqrt, exp
 import matplotlib.pyplot as plt
 from matplotlib.font_manager import FontProperties
 from matplotlib.backends.backend_pdf import PdfPages
+from waveforms import load_waveform
+
+# contiguous float64 copy (or the array itself), which PyROOT hands to the
+# graph constructors as a double* without going through a list
+def as_doubles(a):
+    return np.ascontiguousarray(a, dtype=np.float64)
 
 # Factor to match the impedances of the two oscilloscopes used to measure
 
@@ -180,7 +185,7 @@ def CalibrationRiseTime(calibration_filename):
     gStyle.SetOptStat(1111)
 
     # Construct the  curve
-    calib_curve = TGraphErrors(len(C), array('d',C.tolist()), array('d', fall_time.tolist()), array('d', e_C.tolist()), array('d',d_fall_time.tolist()) )
+    calib_curve = TGraphErrors(len(C), as_doubles(C), as_doubles(fall_time), as_doubles(e_C), as_doubles(d_fall_time) )
 
     # Construct the fit with a 2nd order polynomial
     fit_curve = TF1('fit_curve','[0]*x*x + [1]*x + [2]',0.,110.)
@@ -244,7 +249,7 @@ def CalibrationENC(calibration_filename):
     
     d_ENC = d_ENC * pow(10,-15) / (1.602 * pow(10,-19) ) # conversted to # of electrons
 
-    calib_curve = TGraphErrors(len(ENC), array('d', C[:-1].tolist()), array('d', ENC.tolist()), array('d', e_C.tolist()), array('d', d_ENC) )
+    calib_curve = TGraphErrors(len(ENC), as_doubles(C), as_doubles(ENC), as_doubles(e_C), as_doubles(d_ENC) )
 
     # Construct the fit with a 1st and 2nd order polynomial
     fit_curve = TF1('fit_curve','[1]*x + [0]',0.,110.)
@@ -305,7 +310,8 @@ def SignalCurves(datasets, path):
     amplitude_error        = []
 
     for i in datasets:
-        q = np.loadtxt(path + i, skiprows=6, delimiter=',')
+        # decoded once to float32 and memory-mapped from the cache afterwards
+        q = load_waveform(path + i)
         decay_data.append(q)
         print "MESSAGE INFO: The sample %s has been loaded "%(i)
 
@@ -315,7 +321,7 @@ def SignalCurves(datasets, path):
 
         data[:,1] = data[:,1]
 
-        curve = TGraph(len(data[:,0]), array('d', data[:,0]), array('d', data[:,1]) )
+        curve = TGraph(len(data[:,0]), as_doubles(data[:,0]), as_doubles(data[:,1]) )
         decay_curve.append(curve)
 
         # The limits for the rise time fits need to be hard coded, since not all the 
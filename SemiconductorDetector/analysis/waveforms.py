@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Readers for LeCroy oscilloscope captures.
+
+Both the exported CSV files and the native binary `.trc` files are decoded
+straight into an (n_points, 2) float32 array of [time, amplitude], the same
+layout `np.loadtxt(path, skiprows=6, delimiter=',')` gave. Decoded captures
+are kept as `.npy` files in a cache directory and memory-mapped on the next
+load, so re-analysing many captures does not parse any text again.
+"""
+
+import os
+import glob
+import struct
+import hashlib
+import numpy as np
+
+CACHE_DIR = os.environ.get('WAVEFORM_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', '.waveform_cache'))
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+# LeCroy CSV export: a few header lines, then `time,amplitude` rows
+def read_lecroy_csv(filename, skiprows=6):
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    start = 0
+    for i in range(skiprows):
+        start = raw.find(b'\n', start) + 1
+        if start == 0:
+            return np.zeros((0, 2), dtype=np.float32)
+    body = raw[start:]
+    first = body[:body.find(b'\n')] if b'\n' in body else body
+    ncols = first.count(b',') + 1
+    values = np.fromstring(body.replace(b',', b' ').decode('ascii'), dtype=np.float32, sep=' ')
+    return values[:len(values)//ncols*ncols].reshape(-1, ncols)
+
+
+# (offset, struct format) of the WAVEDESC fields that are needed, see the
+# LeCroy remote control manual (template LECROY_2_3)
+_wavedesc = {'comm_type':        (32, 'h'),
+             'comm_order':       (34, 'h'),
+             'wave_descriptor':  (36, 'i'),
+             'user_text':        (40, 'i'),
+             'res_desc1':        (44, 'i'),
+             'trigtime_array':   (48, 'i'),
+             'ris_time_array':   (52, 'i'),
+             'res_array1':       (56, 'i'),
+             'wave_array_1':     (60, 'i'),
+             'wave_array_count': (116, 'i'),
+             'vertical_gain':    (156, 'f'),
+             'vertical_offset':  (160, 'f'),
+             'horiz_interval':   (176, 'f'),
+             'horiz_offset':     (180, 'd')}
+
+# native LeCroy binary waveform, amplitude = gain*raw - offset
+def read_lecroy_trc(filename):
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    start = raw.find(b'WAVEDESC')
+    if start < 0:
+        raise ValueError("{:}: no WAVEDESC block found".format(filename))
+
+    # COMM_ORDER is 1 for little and 0 for big endian, 0 reads the same in both
+    endian = '<' if struct.unpack_from('<h', raw, start+34)[0] == 1 else '>'
+    desc = dict((k, struct.unpack_from(endian+fmt, raw, start+off)[0]) for k, (off, fmt) in _wavedesc.items())
+
+    data_start = start + desc['wave_descriptor'] + desc['user_text'] + desc['trigtime_array'] \
+                 + desc['ris_time_array'] + desc['res_array1']
+    dtype = np.dtype(endian + ('i2' if desc['comm_type'] == 1 else 'i1'))
+    n = desc['wave_array_1'] // dtype.itemsize
+    adc = np.frombuffer(raw, dtype=dtype, count=n, offset=data_start)
+
+    wave = np.empty((n, 2), dtype=np.float32)
+    wave[:, 0] = np.arange(n)*desc['horiz_interval'] + desc['horiz_offset']
+    wave[:, 1] = adc*desc['vertical_gain'] - desc['vertical_offset']
+    return wave
+
+
+def read_waveform(filename, skiprows=6):
+    if filename.lower().endswith('.trc'):
+        return read_lecroy_trc(filename)
+    return read_lecroy_csv(filename, skiprows)
+
+# one entry per capture and skiprows, named <capture key>.<size>_<mtime>.npy:
+# a modified file gets a new name, stale entries are never read
+def _entry_path(filename, skiprows, cache_dir=None):
+    st = os.stat(filename)
+    key = "{:}:{:d}".format(os.path.abspath(filename), skiprows)
+    return os.path.join(cache_dir or CACHE_DIR, "{:}.{:d}_{:d}.npy".format(
+        hashlib.sha1(key.encode('utf-8')).hexdigest(), st.st_size, int(st.st_mtime*1e9)))
+
+# remove the entries of earlier versions of the capture of path
+def _evict_stale(path):
+    prefix = os.path.basename(path).split('.')[0]
+    for f in glob.glob(os.path.join(os.path.dirname(path), prefix+'.*.npy')):
+        if f != path:
+            os.remove(f)
+
+# load a capture through the cache; the returned array is a copy-on-write
+# memory map of the cached `.npy`, so it can be modified like a normal array
+def load_waveform(filename, use_cache=True, skiprows=6, cache_dir=None):
+    if not use_cache:
+        return read_waveform(filename, skiprows)
+    path = _entry_path(filename, skiprows, cache_dir)
+    if not os.path.exists(path):
+        wave = read_waveform(filename, skiprows)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path+'.tmp', 'wb') as f:
+                np.save(f, wave)
+            _replace(path+'.tmp', path)
+            _evict_stale(path)
+        except (IOError, OSError):
+            return wave
+    return np.load(path, mmap_mode='c')
+
+def clear_cache(cache_dir=None):
+    files = glob.glob(os.path.join(cache_dir or CACHE_DIR, '*.npy'))
+    for f in files:
+        os.remove(f)
+    return len(files)